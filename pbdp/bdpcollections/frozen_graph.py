@@ -0,0 +1,379 @@
+__author__ = 'davide'
+
+import copy
+
+import numpy as np
+
+
+class FrozenGraph(object):
+    """
+    A compact, read-only snapshot of an abstraction Graph.
+
+    Nodes are mapped to integer ids and the adjacency is stored in CSR form: the neighbours of node `i` are
+    `targets[offsets[i]:offsets[i + 1]]` and `slot_edges` holds, for the same slots, the id of the undirected
+    edge. Edge labels must be dictionaries with a "type" and a "cost" entry; they are stored as the `types` and
+    `costs` arrays indexed by edge id.
+
+    The structure can not change. Edge costs (and types) can still be updated, so the snapshot can be used
+    wherever the original Graph was used by the search code. `cost_overlay` returns a copy sharing every array
+    until its first cost update.
+    """
+
+    def __init__(self, graph):
+        """
+        Build the snapshot of an existing Graph.
+        :param graph: The source Graph.
+        :type graph Graph
+        """
+        self.nodes = list(graph.vertices)
+        self.node_ids = dict((node, i) for i, node in enumerate(self.nodes))
+        self.vertex_labels = dict(graph.vertex_labels)
+        self.edge_keys = list(graph.canonical_edges)
+        self.type_names = []
+
+        edge_count = len(self.edge_keys)
+        self.costs = np.full(edge_count, float('inf'), dtype=np.float64)
+        self.types = np.full(edge_count, -1, dtype=np.int8)
+        self._owns_labels = True
+        rows = [[] for _ in self.nodes]
+        for eid, (first, second) in enumerate(self.edge_keys):
+            label = graph.get_edge_label((first, second))
+            if label is not None:
+                self.costs[eid] = label["cost"]
+                self.types[eid] = self._type_code(label["type"])
+            first_id, second_id = self.node_ids[first], self.node_ids[second]
+            rows[first_id].append((second_id, eid))
+            rows[second_id].append((first_id, eid))
+
+        self.offsets = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        self.targets = np.empty(2 * edge_count, dtype=np.int32)
+        self.slot_edges = np.empty(2 * edge_count, dtype=np.int32)
+        slot = 0
+        for i, row in enumerate(rows):
+            row.sort()
+            for target, eid in row:
+                self.targets[slot] = target
+                self.slot_edges[slot] = eid
+                slot += 1
+            self.offsets[i + 1] = slot
+
+    @classmethod
+    def from_arrays(cls, nodes, node_index, edge_nodes, offsets, targets, slot_edges, costs, types, type_names):
+        """
+        Build a snapshot of a graph of (row, column) tiles on existing arrays, without copying them (e.g., arrays
+        memory-mapped from a file). Nodes and edges are read from the arrays when accessed (see TileArray,
+        TileIndex and EdgeArray). The costs and types are copied on the first update, as for `cost_overlay`.
+        :param nodes: The (node count, 2) array of the tiles of the nodes, in id order.
+        :param node_index: The (height, width) array of the node id of every tile, or -1.
+        :param edge_nodes: The (edge count, 2) array of the node ids of every edge, in its canonical orientation.
+        :param type_names: The list of the edge type names, in code order.
+        :rtype: FrozenGraph
+        """
+        graph = cls.__new__(cls)
+        graph.nodes = TileArray(nodes)
+        graph.node_ids = TileIndex(node_index)
+        graph.vertex_labels = {}
+        graph.edge_keys = EdgeArray(edge_nodes, graph.nodes)
+        graph.type_names = list(type_names)
+        graph.offsets, graph.targets, graph.slot_edges = offsets, targets, slot_edges
+        graph.costs, graph.types = costs, types
+        graph._owns_labels = False
+        return graph
+
+    def _type_code(self, type_name):
+        if type_name not in self.type_names:
+            self.type_names.append(type_name)
+        return self.type_names.index(type_name)
+
+    @property
+    def node_count(self):
+        return len(self.nodes)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_keys)
+
+    ## INTEGER INTERFACE ##
+
+    def neighbour_ids(self, node_id):
+        """
+        :param node_id: The target node id.
+        :return: A pair of lists (neighbour ids, edge ids) for the given node.
+        """
+        start, end = self.offsets[node_id], self.offsets[node_id + 1]
+        return self.targets[start:end].tolist(), self.slot_edges[start:end].tolist()
+
+    def edge_id(self, edge):
+        """
+        Return the id of the given edge.
+        :param edge: The target edge, in any orientation.
+        :return: The edge id or None if the edge does not exist.
+        """
+        first_id = self.node_ids.get(edge[0])
+        second_id = self.node_ids.get(edge[1])
+        if first_id is None or second_id is None:
+            return None
+        start, end = self.offsets[first_id], self.offsets[first_id + 1]
+        slot = start + np.searchsorted(self.targets[start:end], second_id)
+        if slot < end and self.targets[slot] == second_id:
+            return int(self.slot_edges[slot])
+        return None
+
+    def edge_ids_of_type(self, type_name):
+        """
+        :return: The array of the ids of all the edges with the given type.
+        """
+        if type_name not in self.type_names:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.types == self.type_names.index(type_name))
+
+    ## GRAPH INTERFACE ##
+
+    @property
+    def vertices(self):
+        """
+        :return: Returns the list of vertices in the graph.
+        """
+        return iter(self.nodes)
+
+    @property
+    def edges(self):
+        """
+        :return: Returns the list of edges in the graph (both orientations of every edge).
+        """
+        return ((x, y) for x in self.nodes for y in self.neighbours(x))
+
+    @property
+    def canonical_edges(self):
+        """
+        :return: Returns the list of edges in the graph, each undirected edge exactly once.
+        """
+        return iter(self.edge_keys)
+
+    def canonical_edge(self, edge):
+        eid = self.edge_id(edge)
+        return self.edge_keys[eid] if eid is not None else None
+
+    def add_node(self, node, meta=None):
+        raise TypeError("FrozenGraph is read-only.")
+
+    def add_edge(self, first, second, meta=None):
+        raise TypeError("FrozenGraph is read-only.")
+
+    def remove_edge(self, first, second):
+        raise TypeError("FrozenGraph is read-only.")
+
+    def remove_node(self, node):
+        raise TypeError("FrozenGraph is read-only.")
+
+    def update_node_label(self, node, meta):
+        if node in self.node_ids:
+            self.vertex_labels[node] = meta
+
+    def update_edge_label(self, edge, meta):
+        """
+        Update the type and the cost of an edge. It does nothing if the edge does not exist.
+        :param edge: The target edge.
+        :param meta: A dictionary with the new "type" and "cost" of the edge.
+        """
+        eid = self.edge_id(edge)
+        if eid is not None:
+            if not self._owns_labels:
+                self.costs = self.costs.copy()
+                self.types = self.types.copy()
+                self.type_names = list(self.type_names)
+                self._owns_labels = True
+            self.costs[eid] = meta["cost"]
+            self.types[eid] = self._type_code(meta["type"])
+
+    def get_vertex_label(self, node):
+        if node in self.node_ids:
+            return self.vertex_labels[node]
+
+    def get_edge_label(self, edge):
+        eid = self.edge_id(edge)
+        if eid is not None and self.types[eid] >= 0:
+            return {"type": self.type_names[self.types[eid]], "cost": float(self.costs[eid])}
+
+    def neighbours(self, node):
+        """
+        Return all the vertices coming out from "node".
+        :param node: The target node.
+        :return: The list of vertices adjacent to the target node.
+        """
+        node_id = self.node_ids[node]
+        return [self.nodes[i] for i in self.targets[self.offsets[node_id]:self.offsets[node_id + 1]].tolist()]
+
+    def is_adjacent(self, node_a, node_b):
+        return self.edge_id((node_a, node_b)) is not None
+
+    def __getitem__(self, item):
+        return self.neighbours(item)
+
+    def __contains__(self, item):
+        return item in self.node_ids
+
+    def cost_overlay(self):
+        """
+        :return: A FrozenGraph sharing the structure with this one. The edge costs and types are copied on the
+                 first update, so updates never affect this graph.
+        """
+        overlay = copy.copy(self)
+        overlay._owns_labels = False
+        self._owns_labels = False
+        return overlay
+
+
+class TileArray(object):
+    """
+    A read-only sequence of (row, column) tuples backed by an (n, 2) integer array.
+    """
+
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, item):
+        return tuple(self.array[item].tolist())
+
+    def __iter__(self):
+        return (tuple(x) for x in self.array.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.array, dtype=dtype)
+
+
+class TileIndex(object):
+    """
+    A read-only mapping from (row, column) tuples to ids, backed by a (height, width) integer array holding the
+    id of every tile, or -1.
+    """
+
+    def __init__(self, array):
+        self.array = array
+
+    def get(self, tile, default=None):
+        try:
+            r, c = tile
+        except (TypeError, ValueError):
+            return default
+        if 0 <= r < self.array.shape[0] and 0 <= c < self.array.shape[1]:
+            value = int(self.array[r, c])
+            if value >= 0:
+                return value
+        return default
+
+    def __getitem__(self, item):
+        value = self.get(item)
+        if value is None:
+            raise KeyError(item)
+        return value
+
+    def __contains__(self, item):
+        return self.get(item) is not None
+
+
+class EdgeArray(object):
+    """
+    A read-only sequence of the (first node, second node) pairs of the edges, backed by an (edge count, 2) array
+    of node ids.
+    """
+
+    def __init__(self, edge_nodes, nodes):
+        """
+        :param edge_nodes: The array of the node ids of every edge.
+        :param nodes: The sequence of the nodes, in id order.
+        """
+        self.edge_nodes = edge_nodes
+        self.nodes = nodes
+
+    def __len__(self):
+        return len(self.edge_nodes)
+
+    def __getitem__(self, item):
+        first, second = self.edge_nodes[item].tolist()
+        return self.nodes[first], self.nodes[second]
+
+    def __iter__(self):
+        return ((self.nodes[first], self.nodes[second]) for first, second in self.edge_nodes.tolist())
+
+
+class ExtendedFrozenGraph(object):
+    """
+    The integer counterpart of ExtendedGraph: a FrozenGraph with some extra nodes (e.g., the start and the goal
+    of a query) connected to nodes of the frozen graph. Extra nodes get the ids following the frozen ones.
+
+    It exposes `successors(node_id)`, the interface used by `astar_indexed`.
+    """
+
+    def __init__(self, frozen_graph, costs=None, allowed=None):
+        """
+        :param frozen_graph: The original FrozenGraph.
+        :type frozen_graph FrozenGraph
+        :param costs: An optional array of edge costs, indexed by edge id, used in place of the graph ones.
+        :param allowed: An optional set of node ids of the frozen graph. If given, the other nodes of the frozen
+                        graph are never returned as successors.
+        """
+        self._frozen = frozen_graph
+        self._allowed = allowed
+        self._costs = frozen_graph.costs if costs is None else costs
+        self._offsets = frozen_graph.offsets
+        self._targets = frozen_graph.targets
+        self._slot_edges = frozen_graph.slot_edges
+        self.ext_nodes = []
+        self.ext_successors = []
+        self.boundary = {}  # Frozen node id -> list of (extended node id, cost)
+
+    @property
+    def node_count(self):
+        return self._frozen.node_count + len(self.ext_nodes)
+
+    def add_extended_node(self, new_node, adjacent_nodes, costs):
+        """
+        Add a node to the extension.
+        :param new_node: A new node. This node must not be included in the original graph.
+        :param adjacent_nodes: A list of adjacent nodes of the original graph.
+        :param costs: The cost of the edge toward every adjacent node.
+        :return: The id of the new node.
+        """
+        if new_node in self._frozen.node_ids:
+            return self._frozen.node_ids[new_node]
+        new_id = self.node_count
+        self.ext_nodes.append(new_node)
+        successors = []
+        for node, cost in zip(adjacent_nodes, costs):
+            node_id = self._frozen.node_ids[node]
+            successors.append((node_id, cost))
+            self.boundary.setdefault(node_id, []).append((new_id, cost))
+        self.ext_successors.append(successors)
+        return new_id
+
+    def node(self, node_id):
+        """
+        :return: The node object with the given id.
+        """
+        base_count = self._frozen.node_count
+        return self._frozen.nodes[node_id] if node_id < base_count else self.ext_nodes[node_id - base_count]
+
+    def node_id(self, node):
+        if node in self._frozen.node_ids:
+            return self._frozen.node_ids[node]
+        return self._frozen.node_count + self.ext_nodes.index(node)
+
+    def successors(self, node_id):
+        """
+        :param node_id: The target node id.
+        :return: The list of (neighbour id, cost) pairs of the given node.
+        """
+        base_count = self._frozen.node_count
+        if node_id >= base_count:
+            return self.ext_successors[node_id - base_count]
+        start, end = self._offsets[node_id], self._offsets[node_id + 1]
+        result = list(zip(self._targets[start:end].tolist(), self._costs[self._slot_edges[start:end]].tolist()))
+        if self._allowed is not None:
+            result = [x for x in result if x[0] in self._allowed]
+        if node_id in self.boundary:
+            result.extend(self.boundary[node_id])
+        return result
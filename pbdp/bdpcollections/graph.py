@@ -5,12 +5,17 @@ import itertools
 class Graph(object):
     """
     The Graph class represents a generic undirected labeled graph.
+
+    Every undirected edge is stored once in `edge_labels` under a canonical key (the orientation
+    used the first time the edge was added). `_edge_keys` maps both orientations of an edge to its
+    canonical key, so adjacency and label queries are constant time.
     """
 
     def __init__(self):
         self.graph = {}
         self.vertex_labels = {}
         self.edge_labels = {}
+        self._edge_keys = {}
 
     @property
     def vertices(self):
@@ -22,9 +27,24 @@ class Graph(object):
     @property
     def edges(self):
         """
-        :return: Returns the list of edges in the graph.
+        :return: Returns the list of edges in the graph (both orientations of every edge).
+        """
+        return ((x, y) for x in self.graph for y in self.graph[x])
+
+    @property
+    def canonical_edges(self):
         """
-        return ((x, y) for x in self.vertices for y in self.vertices if y in self.graph[x])
+        :return: Returns the list of edges in the graph, each undirected edge exactly once.
+        """
+        return (x for x in self._edge_keys if self._edge_keys[x] is x)
+
+    def canonical_edge(self, edge):
+        """
+        Return the key under which the given edge is stored.
+        :param edge: The target edge, in any orientation.
+        :return: The canonical edge tuple or None if the edge does not exist.
+        """
+        return self._edge_keys.get(edge)
 
     def add_node(self, node, meta=None):
         """
@@ -32,7 +52,7 @@ class Graph(object):
         :param node: The node element.
         :param meta: The optional meta-information for the node.
         """
-        if node not in self.graph.keys():
+        if node not in self.graph:
             self.graph[node] = set([])
         if meta is not None:
             self.vertex_labels[node] = meta
@@ -43,7 +63,7 @@ class Graph(object):
         :param node: The target node.
         :param meta: The new meta-information object.
         """
-        if node in self.vertices:
+        if node in self.graph:
             self.vertex_labels[node] = meta
 
     def add_edge(self, first, second, meta=None):
@@ -53,14 +73,19 @@ class Graph(object):
         :param second: The second node.
         :param meta: The optional meta-information for the edge.
         """
-        if first not in self.vertices:
+        if first not in self.graph:
             self.add_node(first)
-        if second not in self.vertices:
+        if second not in self.graph:
             self.add_node(second)
         self.graph[first].add(second)
         self.graph[second].add(first)
+        key = self._edge_keys.get((first, second))
+        if key is None:
+            key = (first, second)
+            self._edge_keys[key] = key
+            self._edge_keys[(second, first)] = key
         if meta is not None:
-            self.edge_labels[(first, second)] = meta
+            self.edge_labels[key] = meta
 
     def update_edge_label(self, edge, meta):
         """
@@ -68,20 +93,42 @@ class Graph(object):
         :param edge: The target edge.
         :param meta: The new meta-information object.
         """
-        if edge in self.edges:
-            self.edge_labels[edge] = meta
+        key = self._edge_keys.get(edge)
+        if key is not None:
+            self.edge_labels[key] = meta
+
+    def remove_edge(self, first, second):
+        """
+        Remove the edge between two nodes. It does nothing if the edge does not exist. The nodes are kept.
+        :param first: The first node.
+        :param second: The second node.
+        """
+        key = self._edge_keys.pop((first, second), None)
+        if key is not None:
+            self._edge_keys.pop((second, first), None)
+            self.edge_labels.pop(key, None)
+            self.graph[first].discard(second)
+            self.graph[second].discard(first)
+
+    def remove_node(self, node):
+        """
+        Remove a node and all its edges. It does nothing if the node does not exist.
+        :param node: The target node.
+        """
+        if node in self.graph:
+            for other in list(self.graph[node]):
+                self.remove_edge(node, other)
+            del self.graph[node]
+            self.vertex_labels.pop(node, None)
 
     def get_vertex_label(self, node):
-        if node in self.vertices:
+        if node in self.graph:
             return self.vertex_labels[node]
 
     def get_edge_label(self, edge):
-        if edge in self.edges:
-            swap = lambda t: (t[1], t[0])
-            if edge in self.edge_labels.keys():
-                return self.edge_labels[edge]
-            if swap(edge) in self.edge_labels.keys():
-                return self.edge_labels[swap(edge)]
+        key = self._edge_keys.get(edge)
+        if key is not None:
+            return self.edge_labels.get(key)
 
     def neighbours(self, node):
         """
@@ -92,18 +139,108 @@ class Graph(object):
         return self.graph[node]
 
     def is_adjacent(self, node_a, node_b):
-        return (node_a, node_b) in self.edges
+        return (node_a, node_b) in self._edge_keys
 
     def __getitem__(self, item):
         return self.neighbours(item)
 
     def __contains__(self, item):
-        return item in self.graph.keys()
+        return item in self.graph
+
+    def cost_overlay(self):
+        """
+        :return: A CostOverlayGraph sharing the structure and the labels of this graph.
+        """
+        return CostOverlayGraph(self)
+
+
+class CostOverlayGraph(object):
+    """
+    A copy-on-write view of a Graph. The view shares vertices, edges and labels with the original graph and
+    stores only the labels updated through the view. The original graph is never modified.
+    """
+
+    def __init__(self, original_graph):
+        """
+        :param original_graph: The original Graph.
+        """
+        self._original_graph = original_graph
+        self.overridden_labels = {}  # Map from canonical edge to the label replacing the original one.
+
+    @property
+    def vertices(self):
+        return self._original_graph.vertices
+
+    @property
+    def vertex_labels(self):
+        return self._original_graph.vertex_labels
+
+    @property
+    def edges(self):
+        return self._original_graph.edges
+
+    @property
+    def canonical_edges(self):
+        return self._original_graph.canonical_edges
+
+    def canonical_edge(self, edge):
+        return self._original_graph.canonical_edge(edge)
+
+    def add_node(self, node, meta=None):
+        raise TypeError("CostOverlayGraph can not change the graph structure.")
+
+    def add_edge(self, first, second, meta=None):
+        raise TypeError("CostOverlayGraph can not change the graph structure.")
+
+    def remove_edge(self, first, second):
+        raise TypeError("CostOverlayGraph can not change the graph structure.")
+
+    def remove_node(self, node):
+        raise TypeError("CostOverlayGraph can not change the graph structure.")
+
+    def update_edge_label(self, edge, meta):
+        """
+        Override the edge meta-information object. It does nothing if the edge does not exist.
+        :param edge: The target edge.
+        :param meta: The new meta-information object.
+        """
+        key = self._original_graph.canonical_edge(edge)
+        if key is not None:
+            self.overridden_labels[key] = meta
+
+    def get_vertex_label(self, node):
+        return self._original_graph.get_vertex_label(node)
+
+    def get_edge_label(self, edge):
+        key = self._original_graph.canonical_edge(edge)
+        if key in self.overridden_labels:
+            return self.overridden_labels[key]
+        return self._original_graph.get_edge_label(edge)
+
+    def neighbours(self, node):
+        return self._original_graph.neighbours(node)
+
+    def is_adjacent(self, node_a, node_b):
+        return self._original_graph.is_adjacent(node_a, node_b)
+
+    def __getitem__(self, item):
+        return self.neighbours(item)
+
+    def __contains__(self, item):
+        return item in self._original_graph
+
+    def cost_overlay(self):
+        overlay = CostOverlayGraph(self._original_graph)
+        overlay.overridden_labels = dict(self.overridden_labels)
+        return overlay
 
 class ExtendedGraph(object):
     """
     Extended Graph is a graph with some nodes (and edges added) it is used to extend
     a graph with more nodes without generate a full new graph.
+
+    The graph keeps a reverse index from every boundary vertex to the extended nodes adjacent to it,
+    so neighbour and adjacency queries cost the same as on the original graph.
     """
 
     def __init__(self,original_graph):
@@ -114,6 +251,7 @@ class ExtendedGraph(object):
         self._original_graph = original_graph
         self.extension = {}
         self.ext_edge_labels = {}
+        self._boundary = {}  # Map from a boundary vertex to the set of adjacent extended nodes.
 
     @property
     def ext_vertices(self):
@@ -129,7 +267,7 @@ class ExtendedGraph(object):
     @property
     def ext_edges(self):
         swap = lambda t: (t[1], t[0])
-        edges = ((x, y) for x in self.ext_vertices for y in self.extension[x])
+        edges = [(x, y) for x in self.ext_vertices for y in self.extension[x]]
         return itertools.chain(edges, (swap(x) for x in edges))
 
     @property
@@ -145,10 +283,7 @@ class ExtendedGraph(object):
         This are the vertex that are in the original graph BUT are adjacent with the extended one.
         :return:
         """
-        b_vertex = set()
-        for nodes in self.extension.values():
-            b_vertex = b_vertex.union(nodes)
-        return b_vertex
+        return set(self._boundary.keys())
 
     def add_extended_node(self, new_node, adjacent_nodes, labels=None):
         """
@@ -158,28 +293,45 @@ class ExtendedGraph(object):
         """
         if new_node not in self._original_graph:
             # TODO: Check if ALL adjacent vertex are in the original graph.
+            if new_node in self.extension:
+                self._remove_extended_node(new_node)
             self.extension[new_node] = adjacent_nodes
+            for node in adjacent_nodes:
+                self._boundary.setdefault(node, set()).add(new_node)
             if labels is not None:
                 for i in range(len(adjacent_nodes)):
                     self.ext_edge_labels[(new_node,adjacent_nodes[i])] = labels[i]
 
+    def _remove_extended_node(self, node):
+        for adjacent in self.extension.pop(node):
+            self._boundary[adjacent].discard(node)
+            if not self._boundary[adjacent]:
+                del self._boundary[adjacent]
+            self.ext_edge_labels.pop((node, adjacent), None)
+
     def get_edge_label(self, edge):
-        swap = lambda t: (t[1], t[0])
-        if edge in self.ext_edge_labels.keys():
+        if edge in self.ext_edge_labels:
             return self.ext_edge_labels[edge]
-        if swap(edge) in self.ext_edge_labels.keys():
-            return self.ext_edge_labels[swap(edge)]
+        swapped = (edge[1], edge[0])
+        if swapped in self.ext_edge_labels:
+            return self.ext_edge_labels[swapped]
         return self._original_graph.get_edge_label(edge)
 
     def neighbours(self, node):
-        if node in self.ext_vertices:
+        if node in self.extension:
             return self.extension[node]
         original_neighbours = self._original_graph.neighbours(node)
-        if node in self.boundary_vertices:
-            extended_adjacent = set([x for x in self.ext_vertices if node in self.extension[x]])
-            return extended_adjacent.union(original_neighbours)
+        if node in self._boundary:
+            return self._boundary[node].union(original_neighbours)
         else:
             return original_neighbours
 
     def is_adjacent(self, node_a, node_b):
-        return (node_a, node_b) in self.edges or (node_b, node_a) in self.edges
\ No newline at end of file
+        if node_a in self._boundary and node_b in self._boundary[node_a]:
+            return True
+        if node_b in self._boundary and node_a in self._boundary[node_b]:
+            return True
+        return self._original_graph.is_adjacent(node_a, node_b)
+
+    def __contains__(self, item):
+        return item in self.extension or item in self._original_graph
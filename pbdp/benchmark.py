@@ -1,9 +1,9 @@
 import os, os.path
 import random
 import itertools
-import copy
 import csv
 
+from pbdp.model.abstraction_cache import AbstractionCache
 from pbdp.model.hierarchical_map import HierarchicalMap
 from pbdp.model.vector2d import Vec2d
 from pbdp.model.map import LogicalMap, distance_euclidean
@@ -12,6 +12,15 @@ from pbdp.search.hpa import hpa_high_level
 
 from pbdp.mcts.optimistic_policy import OptimisticPolicy
 
+# Directory of the saved abstractions of the maps in './maps'.
+ABSTRACTION_CACHE_DIRECTORY = './.abstraction_cache'
+
+# Shared by all the runs, so map files are hashed once per process.
+ABSTRACTION_CACHE = AbstractionCache(ABSTRACTION_CACHE_DIRECTORY)
+
+# Bundles opened by this process: (map name, division) -> MapBundle.
+_bundles = {}
+
 
 def maps_loader():
     """
@@ -25,6 +34,21 @@ def maps_loader():
     return map_database
 
 
+def load_bundle(map_name, logical_map, division):
+    """
+    Return the compiled bundle of a map of the database (see `MapBundle`), compiled once in the abstraction cache
+    and opened once per process. Its abstraction is memory-mapped, so worker processes share it.
+    :param map_name: The name of the map file in './maps'.
+    :param logical_map: The parsed map.
+    :param division: The cluster size, as a fraction of the map width.
+    :rtype: MapBundle
+    """
+    key = (map_name, division)
+    if key not in _bundles:
+        _bundles[key] = ABSTRACTION_CACHE.bundle('./maps/' + map_name, division, logical_map)
+    return _bundles[key]
+
+
 def abstract_all(map_database, division):
     """
     Given a list of parsed maps, returns a list of abstracted maps.
@@ -62,7 +86,7 @@ def randomize_map(map_abstraction):
     :param map:
     :return:
     """
-    map_copy = copy.deepcopy(map_abstraction)
+    map_copy = map_abstraction.cost_view()
     for edge in map_copy.abstraction_graph.edges:
         if map_copy.is_edge_type(edge, 'inter'):
             if random.random() < -0.01:  # TODO: Make this a PARAMETER
@@ -3,7 +3,6 @@ from yoshix.exporter import YoshiEggCSVExporter
 
 import pbdp.benchmark as benchmark
 from pbdp.mcts.optimistic_policy import OptimisticPolicy
-from pbdp.model.hierarchical_map import HierarchicalMap
 from pbdp.model.agents.agent import VirtualAgent
 
 class OptimisticPolicyBaseExperiment(YoshiExperiment):
@@ -17,8 +16,7 @@ class OptimisticPolicyBaseExperiment(YoshiExperiment):
     def single_run(self, params):
         print("Single Run {}".format(self.run_counter))
         policy_function = lambda x, y, z, w: OptimisticPolicy.search_path(x, y, z, w, 0.2)
-        map_abstraction = HierarchicalMap(params["Map"][1], 0.2)
-        map_abstraction.generate_abstract_graph()
+        map_abstraction = benchmark.load_bundle(params["Map"][0], params["Map"][1], 0.2).abstraction()
         copymap = benchmark.randomize_map(map_abstraction)
         start, end = benchmark.random_path(params["Map"][1], copymap)
         print("From {} to {}".format(start, end))
@@ -1,12 +1,57 @@
 __author__ = 'davide'
 
-import copy
+import math
 import random
+import time
+
+import numpy as np
 
-from pbdp.model.map import LogicalMap, distance_euclidean
-from pbdp.search.hpa import hpa_high_level
 from pbdp.model.path import Path
 from pbdp.model.policy import Policy
+from pbdp.mcts.rollouts import RolloutCache, RolloutSampler, run_rollouts, parallel_rollouts, ROLLOUTS_PER_TASK
+
+
+class FirstActionStatistics(object):
+    """
+    Running mean and variance (Welford) of the rollout path lengths, grouped by the first action of the path. They
+    are the same quantities ranked by `Policy.next_action_score` at the start position.
+    """
+
+    def __init__(self):
+        self.actions = {}  # Map from action to [count, mean, sum of squared deviations].
+
+    def add(self, path):
+        """
+        :param path: A non-empty rollout Path.
+        """
+        action = path.to_tuple()[1]
+        stats = self.actions.setdefault(action, [0, 0.0, 0.0])
+        stats[0] += 1
+        delta = path.length - stats[1]
+        stats[1] += delta / stats[0]
+        stats[2] += delta * (path.length - stats[1])
+
+    def is_stable(self, z_score, tolerance=0.0):
+        """
+        Check if the lead of the best action over the runner-up is statistically stable, that is, if the difference
+        of their mean lengths exceeds `z_score` standard errors. The choice is stable as well if, with the same
+        confidence, the two actions are equivalent: their difference is smaller than `tolerance`.
+        :param z_score: The required number of standard errors.
+        :param tolerance: The length difference below which two actions are equivalent.
+        :return: True if the choice of the best action is stable.
+        """
+        ranked = sorted(self.actions.values(), key=lambda x: x[1])
+        if len(ranked) == 0:
+            return False
+        if len(ranked) == 1:
+            return True
+        best, runner_up = ranked[0], ranked[1]
+        if best[0] < 2 or runner_up[0] < 2:
+            return False
+        error = math.sqrt(best[2] / (best[0] - 1) / best[0] + runner_up[2] / (runner_up[0] - 1) / runner_up[0])
+        difference = runner_up[1] - best[1]
+        return difference > z_score * error or difference + z_score * error < tolerance
+
 
 class HindsightOptimization(object):
     """
@@ -15,23 +60,92 @@ class HindsightOptimization(object):
     """
 
     @staticmethod
-    def search_path(start, end, map_abstraction, beliefs_model, limit):
+    def search_path(start, end, map_abstraction, beliefs_model, limit, workers=None, seed=None, memoize=True,
+                    lazy=False, pool=None):
+        """
+        Compute a policy from `limit` rollouts.
+        :param workers: If greater than 1, the rollouts are run by a new pool of `workers` processes.
+        :param seed: An optional seed for the rollouts sampling. Given a seed, rollout costs do not depend on the
+                     number of workers (see `RolloutPool`).
+        :param memoize: If True, rollouts reuse previous results when possible (see `RolloutCache`).
+        :param lazy: If True, edges are sampled only when a rollout search reads them (see `LazyClosures`).
+        :param pool: An optional RolloutPool on the same map abstraction, used in place of `workers`. Keep one pool
+                     for all the searches of an agent to start the workers only once.
+        :return: The policy and the profile data.
+        """
         policy = Policy()
-        global_profile_data = {'expanded': 0}
-        for i in range(limit):
-            roll = HindsightOptimization.rollout(map_abstraction, beliefs_model)
-            hpath, cost, profile_data = hpa_high_level(roll, start, end, distance_euclidean)
-            path = Path((hpath, cost))
-            global_profile_data['expanded'] += profile_data['expanded']
+        global_profile_data = {'expanded': 0, 'cache hits': 0, 'cache misses': 0}
+        sampler = RolloutSampler(map_abstraction, beliefs_model)
+        closed = HindsightOptimization._sample(sampler, limit, seed, lazy)
+        if pool is not None:
+            results = pool.run(sampler, start, end, closed, memoize)
+        elif workers is not None and workers > 1:
+            results = parallel_rollouts(sampler, start, end, closed, workers, memoize)
+        else:
+            results = run_rollouts(sampler, start, end, closed, memoize)
+        HindsightOptimization._merge_results(policy, global_profile_data, results, memoize)
+        return policy, global_profile_data
+
+    @staticmethod
+    def adaptive_search_path(start, end, map_abstraction, beliefs_model, limit, z_score=2.0, tolerance=1.0,
+                             time_budget=None, expansion_budget=None, seed=None, memoize=True, lazy=False):
+        """
+        Compute a policy with at most `limit` rollouts, run in batches of ROLLOUTS_PER_TASK. Sampling stops as soon
+        as the choice of the best first action is stable (see `FirstActionStatistics.is_stable`), or when a budget
+        is exhausted. All the batches share the same rollout cache.
+        :param time_budget: Optional wall-clock budget, in seconds.
+        :param expansion_budget: Optional budget of expanded nodes.
+        :return: The policy and the profile data. The profile data include the number of 'rollouts' run.
+        """
+        started = time.perf_counter()
+        policy = Policy()
+        global_profile_data = {'expanded': 0, 'cache hits': 0, 'cache misses': 0, 'rollouts': 0}
+        statistics = FirstActionStatistics()
+        sampler = RolloutSampler(map_abstraction, beliefs_model)
+        closed = HindsightOptimization._sample(sampler, limit, seed, lazy)
+        cache = RolloutCache() if memoize else None
+        for batch_start in range(0, limit, ROLLOUTS_PER_TASK):
+            batch = closed[batch_start:batch_start + ROLLOUTS_PER_TASK]
+            results = run_rollouts(sampler, start, end, batch, memoize, cache)
+            for path in HindsightOptimization._merge_results(policy, global_profile_data, results, memoize):
+                statistics.add(path)
+            global_profile_data['rollouts'] += len(batch)
+            if statistics.is_stable(z_score, tolerance):
+                break
+            if time_budget is not None and time.perf_counter() - started >= time_budget:
+                break
+            if expansion_budget is not None and global_profile_data['expanded'] >= expansion_budget:
+                break
+        return policy, global_profile_data
+
+    @staticmethod
+    def _sample(sampler, limit, seed, lazy):
+        if lazy:
+            return sampler.lazy_sample(limit, seed)
+        return sampler.sample(limit, None if seed is None else np.random.default_rng(seed))
+
+    @staticmethod
+    def _merge_results(policy, profile_data, results, memoize):
+        """
+        Add the results of `run_rollouts` to the policy and to the profile data.
+        :return: The list of the non-empty rollout paths.
+        """
+        paths = []
+        for hpath, cost, expanded, cached in results:
+            path = Path((list(hpath), cost))
+            profile_data['expanded'] += expanded
+            if memoize:
+                profile_data['cache hits' if cached else 'cache misses'] += 1
             if path.is_empty():
                 continue
             policy.add_path(path)
-        return policy, global_profile_data
+            paths.append(path)
+        return paths
 
     @staticmethod
     def rollout(map_abstraction, beliefs_model):
-        map_copy = copy.deepcopy(map_abstraction)
-        for edge in map_copy.edges:
+        map_copy = map_abstraction.cost_view()
+        for edge in map_copy.abstraction_graph.canonical_edges:
             if edge in beliefs_model and random.random() > beliefs_model[edge]:
                 map_copy.close_edge(edge)
         return map_copy
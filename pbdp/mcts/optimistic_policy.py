@@ -1,7 +1,5 @@
 __author__ = 'davide'
 
-import copy
-
 from pbdp.model.map import LogicalMap, distance_euclidean
 from pbdp.search.hpa import hpa_high_level
 from pbdp.model.path import Path
@@ -20,7 +18,7 @@ class OptimisticPolicy(object):
 
     @staticmethod
     def prune_map(map_abstraction, beliefs_model, threshold):
-        map_copy = copy.deepcopy(map_abstraction)
+        map_copy = map_abstraction.cost_view()
         for edge in map_copy.abstraction_graph.edges:
             if edge in beliefs_model and beliefs_model[edge] < threshold:
                 map_copy.close_edge(edge)
@@ -0,0 +1,378 @@
+__author__ = 'davide'
+
+import itertools
+import multiprocessing
+import random
+
+import numpy as np
+
+from pbdp.model.map import distance_euclidean
+from pbdp.search.hpa import hpa_high_level
+
+
+class RolloutSampler(object):
+    """
+    Sample the closures of the belief-tracked "inter" edges of a map abstraction.
+
+    Every inter edge known by the beliefs model gets a dense index. The open/closed state of all the edges for all
+    the rollouts is drawn with a single NumPy call, and every rollout is then handed to the high-level search as an
+    array of edge costs over the frozen abstraction (see `hpa_high_level`).
+
+    Alternatively, `lazy_sample` returns rollouts whose edges are drawn only when the search reads them.
+    """
+
+    def __init__(self, map_abstraction, beliefs_model):
+        """
+        :param map_abstraction: The map abstraction. A frozen view of it is used for the searches.
+        :type map_abstraction HierarchicalMap
+        :param beliefs_model: The agent's beliefs model.
+        :type beliefs_model AgentBeliefsModel
+        """
+        frozen = map_abstraction.frozen_view()
+        values, tracked = beliefs_model.edge_values(frozen.abstraction_graph)
+        inter_edges = frozen.abstraction_graph.edge_ids_of_type('inter')
+        edge_ids = inter_edges[tracked[inter_edges]]
+        self._setup(frozen, edge_ids, values[edge_ids])
+
+    @classmethod
+    def from_edges(cls, map_abstraction, edge_ids, open_probabilities):
+        """
+        Build a sampler from the ids of the belief-tracked edges and their probabilities of being open, as found
+        in the `edge_ids` and `open_probabilities` of another sampler.
+        :rtype: RolloutSampler
+        """
+        sampler = cls.__new__(cls)
+        sampler._setup(map_abstraction.frozen_view(), edge_ids, open_probabilities)
+        return sampler
+
+    def _setup(self, frozen, edge_ids, open_probabilities):
+        self.map_abstraction = frozen
+        graph = frozen.abstraction_graph
+        self.base_costs = graph.costs
+        self.edge_ids = edge_ids  # Dense index -> edge id.
+        self.open_probabilities = open_probabilities
+        self.dense_index = np.full(graph.edge_count, -1, dtype=np.int64)  # Edge id -> dense index (or -1).
+        self.dense_index[self.edge_ids] = np.arange(len(self.edge_ids))
+        self._coordinates = np.array(graph.nodes, dtype=np.float64).reshape(-1, 2)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_ids)
+
+    def sample(self, rollouts, rng=None):
+        """
+        Draw the closures for a batch of rollouts.
+        :param rollouts: The number of rollouts.
+        :param rng: An optional numpy.random.Generator. By default one is seeded from the `random` module.
+        :return: A boolean array of shape (rollouts, edge_count). True means that the edge is closed.
+        """
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+        return rng.random((rollouts, self.edge_count)) > self.open_probabilities
+
+    def lazy_sample(self, rollouts, seed=None):
+        """
+        Prepare a batch of rollouts whose closures are drawn on demand. Every rollout has its own random stream,
+        spawned from `seed`.
+        :param rollouts: The number of rollouts.
+        :param seed: An optional seed. By default the seed is drawn from the `random` module.
+        :return: A list of LazyClosures.
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+        streams = np.random.SeedSequence(seed).spawn(rollouts)
+        return [LazyClosures(self.open_probabilities, np.random.default_rng(x)) for x in streams]
+
+    def edge_costs(self, closed):
+        """
+        Return the edge costs of the abstraction in a rollout.
+        :param closed: A row of the array returned by `sample` or a LazyClosures.
+        :return: The array of edge costs, indexed by edge id. For lazy rollouts, an object that computes the costs
+                 of the edge ids it is indexed with.
+        """
+        if isinstance(closed, LazyClosures):
+            return LazyEdgeCosts(self, closed)
+        costs = self.base_costs.copy()
+        costs[self.edge_ids[closed]] = float('inf')
+        return costs
+
+    def dense_edges(self, edge_ids):
+        """
+        :param edge_ids: An array of edge ids of the abstraction.
+        :return: The dense indices of the belief-tracked edges among the given ones.
+        """
+        dense = self.dense_index[edge_ids]
+        return dense[dense >= 0]
+
+    def goal_distances(self, goal):
+        """
+        :return: The array of the Euclidean distances between every abstraction node and the goal.
+        """
+        return np.hypot(self._coordinates[:, 0] - goal[0], self._coordinates[:, 1] - goal[1])
+
+    def relevant_closures(self, expansions, closed, cost, goal_distances):
+        """
+        Return the closures that the result of a rollout search depends on.
+
+        A closed edge read by the search is relevant only if, once open, it could lead to a path cheaper than the
+        one found: the g-score of its expanded end, plus its cost, plus the distance of the other end to the goal
+        must be lower than `cost`.
+        :param expansions: The (node id, g) pairs of the search (see `hpa_high_level`).
+        :param closed: The closures of the rollout.
+        :param cost: The cost of the search result (infinite if no path was found).
+        :param goal_distances: The array returned by `goal_distances`.
+        :return: The dense indices of the relevant closed edges.
+        """
+        if not expansions:
+            return np.empty(0, dtype=np.int64)
+        graph = self.map_abstraction.abstraction_graph
+        nodes = np.array([x[0] for x in expansions], dtype=np.int64)
+        g_scores = np.array([x[1] for x in expansions], dtype=np.float64)
+        starts = graph.offsets[nodes]
+        lengths = graph.offsets[nodes + 1] - starts
+        slots = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        edge_ids = graph.slot_edges[slots]
+        dense = self.dense_index[edge_ids]
+        candidates = (dense >= 0)
+        candidates[candidates] = closed[dense[candidates]]
+        bounds = np.repeat(g_scores, lengths)[candidates] + self.base_costs[edge_ids[candidates]] + \
+            goal_distances[graph.targets[slots][candidates]]
+        return np.unique(dense[candidates][bounds < cost])
+
+    def path_edge_ids(self, path):
+        """
+        :param path: A high-level path.
+        :return: The array of the ids of the abstraction edges along the path.
+        """
+        graph = self.map_abstraction.abstraction_graph
+        edge_ids = [graph.edge_id(edge) for edge in zip(path, path[1:])]
+        return np.array([eid for eid in edge_ids if eid is not None], dtype=np.int64)
+
+
+class LazyClosures(object):
+    """
+    The closures of a single rollout, drawn the first time they are read and then memoized. Indexing it with an
+    array of dense edge indices returns the boolean array of their closures, like a row of `RolloutSampler.sample`.
+    Every edge is drawn once and independently, so rollouts have the same distribution of the eager ones.
+
+    The uniform number of every edge is a hash (SplitMix64) of its dense index and of a key drawn from `rng`, so
+    the closures do not depend on the order in which edges are read (e.g., by cache lookups).
+    """
+
+    UNKNOWN = -1
+
+    def __init__(self, open_probabilities, rng):
+        self._open_probabilities = open_probabilities
+        self._key = rng.integers(0, 2 ** 64, dtype=np.uint64)
+        self.state = np.full(len(open_probabilities), self.UNKNOWN, dtype=np.int8)  # -1 unknown, 0 open, 1 closed.
+
+    @property
+    def drawn(self):
+        """
+        :return: The number of edges drawn so far.
+        """
+        return int(np.count_nonzero(self.state != self.UNKNOWN))
+
+    def __getitem__(self, dense):
+        dense = np.asarray(dense, dtype=np.int64)
+        state = self.state[dense]
+        unknown = state == self.UNKNOWN
+        if unknown.any():
+            missing = np.unique(dense[unknown])
+            self.state[missing] = self._uniforms(missing) > self._open_probabilities[missing]
+            state = self.state[dense]
+        return state == 1
+
+    def _uniforms(self, dense):
+        z = (dense.astype(np.uint64) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15) + self._key
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z ^= z >> np.uint64(31)
+        return (z >> np.uint64(11)) * (1.0 / (1 << 53))
+
+
+class LazyEdgeCosts(object):
+    """
+    The edge costs of a lazy rollout. Indexing it with an array of edge ids returns their costs, drawing the state
+    of the belief-tracked ones when needed.
+    """
+
+    def __init__(self, sampler, closures):
+        """
+        :type sampler RolloutSampler
+        :type closures LazyClosures
+        """
+        self._sampler = sampler
+        self._closures = closures
+
+    def __getitem__(self, edge_ids):
+        costs = self._sampler.base_costs[edge_ids]
+        dense = self._sampler.dense_index[edge_ids]
+        tracked = np.flatnonzero(dense >= 0)
+        if len(tracked) > 0:
+            costs[tracked[self._closures[dense[tracked]]]] = float('inf')
+        return costs
+
+
+class RolloutCache(object):
+    """
+    Memoize the results of the rollout searches.
+
+    A result is stored with the belief-tracked edges it depends on: the edges along its path and the relevant
+    closures met by the search (see `RolloutSampler.relevant_closures`). A later rollout reuses the result if the
+    path is still fully open and those closures are all still in place: no cheaper path can exist, so the result is
+    as good as a new search.
+    """
+
+    def __init__(self):
+        self.entries = []  # List of (path edges, relevant closures, result).
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, closed):
+        """
+        :param closed: The closures of a rollout (a row of `RolloutSampler.sample` or a LazyClosures).
+        :return: A stored result valid for the rollout, or None.
+        """
+        for path_edges, closures, result in self.entries:
+            if closed[closures].all() and not closed[path_edges].any():
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def store(self, closures, path_edges, result):
+        """
+        :param closures: The dense indices of the closures the result depends on.
+        :param path_edges: The dense indices of the edges along the result path.
+        :param result: The result of the search.
+        """
+        self.entries.append((path_edges, closures, result))
+
+
+# Rollouts are processed in tasks of this size, both serially and in parallel. It only sets how rollouts are
+# balanced among workers: rollout caches live for the whole search (one per worker).
+ROLLOUTS_PER_TASK = 32
+
+
+def _split_tasks(closed):
+    return [closed[i:i + ROLLOUTS_PER_TASK] for i in range(0, len(closed), ROLLOUTS_PER_TASK)]
+
+
+def _run_task(sampler, start, end, closed, cache):
+    goal_distances = sampler.goal_distances(end) if cache is not None else None
+    results = []
+    for row in closed:
+        cached = cache.lookup(row) if cache is not None else None
+        if cached is not None:
+            results.append((cached[0], cached[1], 0, True))
+            continue
+        expansions = [] if cache is not None else None
+        hpath, cost, profile_data = hpa_high_level(sampler.map_abstraction, start, end, distance_euclidean,
+                                                   edge_costs=sampler.edge_costs(row), expansions=expansions)
+        result = (tuple(hpath), cost, profile_data['expanded'], False)
+        if cache is not None:
+            closures = sampler.relevant_closures(expansions, row, cost if hpath else float('inf'), goal_distances)
+            cache.store(closures, sampler.dense_edges(sampler.path_edge_ids(hpath)), result)
+        results.append(result)
+    return results
+
+
+def run_rollouts(sampler, start, end, closed, memoize=True, cache=None):
+    """
+    Run the high-level search of every rollout.
+    :param sampler: The RolloutSampler that produced the closures.
+    :param start: The start position.
+    :param end: The destination.
+    :param closed: The closures of the rollouts: the array returned by `RolloutSampler.sample` or the list returned
+                   by `RolloutSampler.lazy_sample`.
+    :param memoize: If True, rollouts reuse the results of previous ones when possible (see `RolloutCache`).
+    :param cache: An optional RolloutCache to use (and fill) in place of a new one, e.g. to share it among the
+                  batches of the same search.
+    :return: The list of (path tuple, cost, expanded nodes, cached) of every rollout, in the same order of `closed`.
+             `cached` is True if the result comes from the cache.
+    """
+    if memoize and cache is None:
+        cache = RolloutCache()
+    return _run_task(sampler, start, end, closed, cache if memoize else None)
+
+
+# State of a rollout worker process: the frozen abstraction, set once per worker by `_init_worker`, and the sampler
+# and the cache of the current search.
+_worker_state = {}
+
+
+def _init_worker(map_abstraction):
+    # With the "fork" start method the arguments are inherited, not pickled.
+    _worker_state['map'] = map_abstraction
+    _worker_state['search'] = None
+
+
+def _run_worker_task(task):
+    search, start, end, edge_ids, open_probabilities, closed, memoize = task
+    if _worker_state['search'] is None or _worker_state['search'][0] != search:
+        sampler = RolloutSampler.from_edges(_worker_state['map'], edge_ids, open_probabilities)
+        _worker_state['search'] = (search, sampler, RolloutCache() if memoize else None)
+    _, sampler, cache = _worker_state['search']
+    return _run_task(sampler, start, end, closed, cache)
+
+
+class RolloutPool(object):
+    """
+    A pool of worker processes running the rollouts of many searches on the same map abstraction, so the cost of
+    starting the workers is paid once. The frozen abstraction reaches the workers when the pool starts: it is
+    inherited on fork when the platform allows it, otherwise it is sent once per worker. Each search only sends
+    the belief-tracked edge ids and the closures; results only carry paths, costs, expanded nodes and cache flags.
+
+    Each worker keeps one RolloutCache for the whole search. Cache reuse never changes costs, so rollout costs do not
+    depend on the number of workers; with `memoize`, paths of equal cost and cache counts may.
+
+    Pools are context managers: leaving the context closes them (see `close`).
+    """
+
+    def __init__(self, map_abstraction, workers):
+        """
+        :param map_abstraction: The map abstraction of the searches. The pool uses its frozen view.
+        :param workers: The number of worker processes.
+        """
+        self.map_abstraction = map_abstraction.frozen_view()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        self._pool = context.Pool(workers, initializer=_init_worker, initargs=(self.map_abstraction,))
+        self._searches = itertools.count()
+
+    def run(self, sampler, start, end, closed, memoize=True):
+        """
+        Same as `run_rollouts`, but the rollouts are split among the workers.
+        :raise ValueError: If the sampler was built on another abstraction (or another version of it).
+        """
+        if sampler.map_abstraction is not self.map_abstraction:
+            raise ValueError("The sampler does not use the abstraction of the pool.")
+        search = next(self._searches)
+        tasks = [(search, start, end, sampler.edge_ids, sampler.open_probabilities, x, memoize)
+                 for x in _split_tasks(closed)]
+        results = self._pool.map(_run_worker_task, tasks, chunksize=1)
+        return [result for chunk in results for result in chunk]
+
+    def close(self):
+        """
+        Stop the workers, waiting for them to exit.
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parallel_rollouts(sampler, start, end, closed, workers, memoize=True):
+    """
+    Same as `run_rollouts`, but the rollouts are split among a new RolloutPool, closed before returning. Use a
+    RolloutPool directly to run many searches on the same workers.
+    :param workers: The number of worker processes.
+    """
+    with RolloutPool(sampler.map_abstraction, workers) as pool:
+        return pool.run(sampler, start, end, closed, memoize)
@@ -0,0 +1,114 @@
+"""
+Persistent cache of map abstractions.
+"""
+
+import hashlib
+import os
+import tempfile
+import zipfile
+
+from pbdp.model.bundle import MapBundle, compile_bundle
+from pbdp.model.hierarchical_map import BUILDER_VERSION, HierarchicalMap
+from pbdp.model.map import LogicalMap
+
+
+class AbstractionCache(object):
+    """
+    A directory of saved abstractions (see `HierarchicalMap.save`).
+
+    Files are keyed by the hash of the map file, the cluster size and the builder version, so a changed map, a
+    different `div_amount` or a new builder never reuse an old abstraction. Missing, stale or unreadable files are
+    replaced by a freshly built abstraction.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._hashes = {}  # Map path -> (modification time, size, digest)
+
+    @staticmethod
+    def map_hash(map_path):
+        """
+        :return: The hex SHA-256 digest of the map file.
+        """
+        digest = hashlib.sha256()
+        with open(map_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def file_hash(self, map_path):
+        """
+        Same as `map_hash`, but the digest is computed again only if the modification time or the size of the
+        file changed.
+        """
+        stat = os.stat(map_path)
+        cached = self._hashes.get(map_path)
+        if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            cached = (stat.st_mtime_ns, stat.st_size, self.map_hash(map_path))
+            self._hashes[map_path] = cached
+        return cached[2]
+
+    def path(self, map_path, cluster_size, extension=".npz"):
+        """
+        :return: The path of the cache file of the given map and cluster size.
+        """
+        name = "{}-c{}-v{}{}".format(self.file_hash(map_path), cluster_size, BUILDER_VERSION, extension)
+        return os.path.join(self.directory, name)
+
+    def get(self, map_path, div_amount, original_map=None, workers=None):
+        """
+        Return the abstraction of a map, loading it from the cache or building (and storing) it.
+        :param map_path: The path of the map file.
+        :param div_amount: The cluster size, as a fraction of the map width (see `HierarchicalMap`).
+        :param original_map: The LogicalMap of the file, if it is already loaded.
+        :param workers: The worker processes used to build the abstraction (see `generate_abstract_graph`).
+        :rtype: HierarchicalMap
+        """
+        if original_map is None:
+            original_map = LogicalMap(map_path)
+        abstraction = HierarchicalMap(original_map, div_amount)
+        path = self.path(map_path, abstraction.cluster_size)
+        if os.path.exists(path):
+            try:
+                return HierarchicalMap.load(original_map, path)
+            except (IOError, ValueError, KeyError, zipfile.BadZipfile):
+                pass  # Build it again.
+        abstraction.generate_abstract_graph(workers)
+        self._write(abstraction.save, path)
+        return abstraction
+
+    def bundle(self, map_path, div_amount, original_map=None, workers=None):
+        """
+        Return the compiled bundle of a map (see `compile_bundle`), compiling it from `get` when it is missing or
+        unreadable. Processes opening the bundle of the same map share its memory.
+        :param map_path: The path of the map file.
+        :param div_amount: The cluster size, as a fraction of the map width (see `HierarchicalMap`).
+        :param original_map: The LogicalMap of the file, if it is already loaded.
+        :param workers: The worker processes used to build the abstraction (see `generate_abstract_graph`).
+        :rtype: MapBundle
+        """
+        if original_map is None:
+            original_map = LogicalMap(map_path)
+        cluster_size = HierarchicalMap(original_map, div_amount).cluster_size
+        path = self.path(map_path, cluster_size, ".bundle")
+        if os.path.exists(path):
+            try:
+                return MapBundle(path)
+            except ValueError:
+                pass  # Compile it again.
+        abstraction = self.get(map_path, div_amount, original_map, workers)
+        self._write(lambda x: compile_bundle(abstraction, x), path)
+        return MapBundle(path)
+
+    def _write(self, save, path):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Write a temporary file first, so concurrent processes never read a partial file.
+        handle, temporary = tempfile.mkstemp(suffix=os.path.splitext(path)[1], dir=self.directory)
+        os.close(handle)
+        try:
+            save(temporary)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
@@ -1,6 +1,6 @@
 __author__ = 'davide'
 
-import copy
+import numpy as np
 
 
 class AgentBeliefsModel(object):
@@ -9,14 +9,32 @@ class AgentBeliefsModel(object):
     of the map.
 
     The data structure store a numerical value for each edge in the HAG representing the
-    degree of belief that that edge is traversable.
+    degree of belief that that edge is traversable. Edges are undirected: both orientations
+    of an edge share the same degree.
 
     If an edge is not present in the ABM it is assumed that the edge is open and immutable
     (assuming that we check for edges that we know exists in the HAG).
+
+    Degrees are stored in an array. When the model is initialized on a map abstraction, the
+    slot of every edge is its edge id in the frozen abstraction graph. Clones share the arrays
+    until one of them is modified (copy-on-write).
+
+    With lazy decay, every degree records the tick of its last update and `decay` only advances
+    the clock. The decayed degree is computed in closed form when it is read.
     """
 
-    def __init__(self):
-        self._beliefs = {}  # Map from edge to a real number.
+    INITIAL_CAPACITY = 16
+
+    def __init__(self, lazy_decay=False):
+        self._slots = {}  # Map from edge (both orientations) to its slot.
+        self._values = np.zeros(self.INITIAL_CAPACITY, dtype=np.float64)
+        self._present = np.zeros(self.INITIAL_CAPACITY, dtype=bool)
+        self._ticks = np.zeros(self.INITIAL_CAPACITY, dtype=np.int64)  # Clock at the last update (lazy decay).
+        self._clock = 0
+        self._lazy_decay = lazy_decay
+        self._size = 0  # Number of used slots.
+        self._graph = None  # The FrozenGraph whose edge ids are the slots, if any.
+        self._shared = False  # True if the arrays and the slots may be shared with a clone.
         self._decay_speed = 0.5  # For now, decay speed is the same for every edge.
 
     def initialize(self, map_abstraction, initial_value=0.5):
@@ -25,10 +43,24 @@ class AgentBeliefsModel(object):
         :param map_abstraction:
         :return:
         """
-        for edge in map_abstraction.abstraction_graph.edge_labels.keys():
-            label = map_abstraction.abstraction_graph.edge_labels[edge]
-            if label["type"] == 'inter':
+        graph = map_abstraction.frozen_view().abstraction_graph
+        if self._size > 0:
+            for edge in map_abstraction.inter_edges:
                 self.update(edge, initial_value)
+            return
+        if not 0.0 <= initial_value <= 1.0:
+            raise ValueError("Value is not a valid degree of belief. Must be in [0,1] interval.")
+        self._unshare()
+        self._grow(graph.edge_count)
+        self._size = graph.edge_count
+        self._graph = graph
+        for eid in graph.edge_ids_of_type('inter').tolist():
+            first, second = graph.edge_keys[eid]
+            self._slots[(first, second)] = eid
+            self._slots[(second, first)] = eid
+            self._values[eid] = initial_value
+            self._present[eid] = True
+        self._ticks[:self._size] = self._clock
 
     def update(self, edge, value):
         """
@@ -38,20 +70,32 @@ class AgentBeliefsModel(object):
                       edge is traversable.
         :return: self
         """
-        if 0.0 <= value <= 1.0:
-            self._beliefs[edge] = value
-        else:
+        if not 0.0 <= value <= 1.0:
             raise ValueError("Value is not a valid degree of belief. Must be in [0,1] interval.")
+        self._unshare()
+        slot = self._slots.get(edge)
+        if slot is None:
+            slot = self._size
+            self._grow(slot + 1)
+            self._size += 1
+            self._slots[edge] = slot
+            self._slots[(edge[1], edge[0])] = slot
+        self._values[slot] = value
+        self._present[slot] = True
+        self._ticks[slot] = self._clock
         return self
 
     def decay(self):
         """
         Execute a decay step. All degrees are pushed toward 0.5 by a small amount.
         """
-        for edge in self._beliefs.keys():
-            current = self._beliefs[edge]
-            if isinstance(self._decay_speed, (int, float)):
-                self._beliefs[edge] = current + self._decay_speed * (0.5 - current)
+        if isinstance(self._decay_speed, (int, float)):
+            if self._lazy_decay:
+                self._clock += 1
+                return self
+            self._unshare()
+            values = self._values[:self._size]
+            values += self._decay_speed * (0.5 - values)
         return self
 
     def decayed(self):
@@ -63,19 +107,84 @@ class AgentBeliefsModel(object):
 
     def clone(self):
         """
-        Create a deep copy of the current ABM instance.
+        Create a copy of the current ABM instance. The copy shares the data with this instance
+        until one of the two is modified.
         :return:
         """
-        res = AgentBeliefsModel()
-        res._beliefs = copy.deepcopy(self._beliefs)
-        res._decay_speed = copy.deepcopy(self._decay_speed)
+        res = AgentBeliefsModel(self._lazy_decay)
+        res._slots = self._slots
+        res._values = self._values
+        res._present = self._present
+        res._ticks = self._ticks
+        res._clock = self._clock
+        res._size = self._size
+        res._graph = self._graph
+        res._decay_speed = self._decay_speed
+        res._shared = self._shared = True
         return res
 
+    def edge_values(self, graph):
+        """
+        Return the degrees of belief of all the edges of a frozen abstraction graph.
+        :param graph: A FrozenGraph.
+        :return: A pair of arrays indexed by edge id: the degrees and a mask of the edges in the model.
+        """
+        if graph is self._graph:
+            return self._current_values(slice(0, graph.edge_count)), self._present[:graph.edge_count].copy()
+        values = np.zeros(graph.edge_count, dtype=np.float64)
+        present = np.zeros(graph.edge_count, dtype=bool)
+        slots = np.zeros(graph.edge_count, dtype=np.int64)
+        for eid, edge in enumerate(graph.edge_keys):
+            slot = self._slots.get(edge)
+            if slot is not None and self._present[slot]:
+                slots[eid] = slot
+                present[eid] = True
+        values[present] = self._current_values(slots[present])
+        return values, present
+
+    def _current_values(self, slots):
+        """
+        :param slots: A slot or an array (or slice) of slots.
+        :return: The current degrees in the given slots (a new array for arrays and slices).
+        """
+        values = self._values[slots]
+        if self._lazy_decay:
+            steps = self._clock - self._ticks[slots]
+            return 0.5 + (values - 0.5) * (1.0 - self._decay_speed) ** steps
+        return values.copy() if isinstance(values, np.ndarray) else values
+
+    def _grow(self, size):
+        if size > len(self._values):
+            capacity = max(size, 2 * len(self._values))
+            values = np.zeros(capacity, dtype=np.float64)
+            present = np.zeros(capacity, dtype=bool)
+            ticks = np.zeros(capacity, dtype=np.int64)
+            values[:self._size] = self._values[:self._size]
+            present[:self._size] = self._present[:self._size]
+            ticks[:self._size] = self._ticks[:self._size]
+            self._values, self._present, self._ticks = values, present, ticks
+
+    def _unshare(self):
+        if self._shared:
+            self._slots = dict(self._slots)
+            self._values = self._values.copy()
+            self._present = self._present.copy()
+            self._ticks = self._ticks.copy()
+            self._shared = False
+
     def __getitem__(self, item):
-        return self._beliefs[item]
+        slot = self._slots[item]
+        if not self._present[slot]:
+            raise KeyError(item)
+        return float(self._current_values(slot))
 
     def __contains__(self, item):
-        return item in self._beliefs.keys()
+        slot = self._slots.get(item)
+        return slot is not None and bool(self._present[slot])
 
     def raw_string(self):
-        return self._beliefs.__str__()
\ No newline at end of file
+        beliefs = {}
+        for edge, slot in self._slots.items():
+            if self._present[slot] and (edge[1], edge[0]) not in beliefs:
+                beliefs[edge] = float(self._current_values(slot))
+        return beliefs.__str__()
@@ -0,0 +1,270 @@
+"""
+Compiled map bundles: a map and its frozen abstraction in a single file that can be memory-mapped.
+"""
+
+import itertools
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from pbdp.bdpcollections.frozen_graph import FrozenGraph, TileArray
+from pbdp.model.hierarchical_map import BUILDER_VERSION, HierarchicalMap
+from pbdp.model.map import LogicalMap, move_masks
+
+MAGIC = b"PBDPBNDL"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def component_labels(passable):
+    """
+    Label the connected components of the traversable tiles. Diagonal moves need both the orthogonal tiles free
+    (see `LogicalMap.cost`), so the components are the 4-connected ones.
+    :param passable: The (height, width) boolean array of the traversable tiles.
+    :return: The (height, width) int32 array of the labels: 0 for blocked tiles, 1 to n for the n components.
+    """
+    height, width = passable.shape
+    flat = passable.ravel()
+    cells = np.arange(flat.size)
+    horizontal = (flat[:-1] & flat[1:]) & ((cells[:-1] + 1) % width != 0)
+    vertical = flat[:-width] & flat[width:]
+    first = np.concatenate([cells[:-1][horizontal], cells[:-width][vertical]])
+    second = np.concatenate([cells[1:][horizontal], cells[width:][vertical]])
+
+    # Union-find in bulk: hook the larger root of every edge to the smaller one, then flatten the trees.
+    parent = cells.copy()
+    while True:
+        root_first, root_second = parent[first], parent[second]
+        different = root_first != root_second
+        if not different.any():
+            break
+        np.minimum.at(parent, np.maximum(root_first, root_second)[different],
+                      np.minimum(root_first, root_second)[different])
+        while True:
+            jumped = parent[parent]
+            if (jumped == parent).all():
+                break
+            parent = jumped
+
+    labels = np.zeros(flat.size, dtype=np.int32)
+    labels[flat] = np.unique(parent[flat], return_inverse=True)[1].ravel() + 1
+    return labels.reshape(height, width)
+
+
+def compile_bundle(map_abstraction, path):
+    """
+    Write the bundle of a map abstraction: the grid, its move masks, the frozen abstraction graph, the entrances,
+    the index of the free tiles and the component labels.
+
+    The file starts with MAGIC, a format version and the length of a JSON header describing every array. The
+    arrays follow, aligned to ALIGNMENT bytes.
+    :param map_abstraction: The map abstraction. Its frozen view is saved.
+    :type map_abstraction HierarchicalMap
+    :param path: The destination path.
+    """
+    frozen = map_abstraction.frozen_view()
+    original_map, graph = frozen.original_map, frozen.abstraction_graph
+    passable = np.ascontiguousarray(original_map.passable)
+
+    def entrance_array(entrances):
+        return np.array([nodes[0] + nodes[1] + clusters[0] + clusters[1] for nodes, clusters in entrances],
+                        dtype=np.int32).reshape(-1, 8)
+
+    nodes = np.array(list(graph.nodes), dtype=np.int32).reshape(-1, 2)
+    node_index = np.full(passable.shape, -1, dtype=np.int32)
+    node_index[nodes[:, 0], nodes[:, 1]] = np.arange(len(nodes), dtype=np.int32)
+
+    # Entrance nodes of every cluster (see `get_all_in_cluster`), in row-major cluster order, and the number of
+    # the vertical ones, which come first.
+    vertical_counts = {}
+    for _, clusters in frozen.vertical_entrances:
+        for cluster in clusters:
+            vertical_counts[cluster] = vertical_counts.get(cluster, 0) + 1
+    cluster_nodes, cluster_offsets, cluster_vertical = [], [0], []
+    for cluster in itertools.product(range(frozen.cluster_height), range(frozen.cluster_width)):
+        cluster_nodes.extend(frozen.get_all_in_cluster(cluster))
+        cluster_offsets.append(len(cluster_nodes))
+        cluster_vertical.append(vertical_counts.get(cluster, 0))
+
+    arrays = [
+        ("grid", np.ascontiguousarray(original_map.grid)),
+        ("passable", passable),
+        ("move_masks", move_masks(passable)),
+        ("free_cells", np.flatnonzero(passable).astype(np.int64)),
+        ("component_labels", component_labels(passable)),
+        ("vertical", entrance_array(frozen.vertical_entrances)),
+        ("horizontal", entrance_array(frozen.horizontal_entrances)),
+        ("cluster_nodes", np.array(cluster_nodes, dtype=np.int32).reshape(-1, 2)),
+        ("cluster_offsets", np.array(cluster_offsets, dtype=np.int64)),
+        ("cluster_vertical", np.array(cluster_vertical, dtype=np.int64)),
+        ("nodes", nodes),
+        ("node_index", node_index),
+        ("edge_nodes", np.array([(graph.node_ids[first], graph.node_ids[second])
+                                 for first, second in graph.edge_keys], dtype=np.int64).reshape(-1, 2)),
+        ("offsets", graph.offsets),
+        ("targets", graph.targets),
+        ("slot_edges", graph.slot_edges),
+        ("costs", graph.costs),
+        ("types", graph.types),
+    ]
+    header = {"builder_version": BUILDER_VERSION, "cluster_size": frozen.cluster_size,
+              "cluster_width": frozen.cluster_width,
+              "type_names": list(graph.type_names), "arrays": {}}
+    offset = 0
+    for name, array in arrays:
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    encoded = json.dumps(header).encode("utf-8")
+    start = -(-(len(MAGIC) + 16 + len(encoded)) // ALIGNMENT) * ALIGNMENT
+
+    with open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("<QQ", FORMAT_VERSION, len(encoded)) + encoded)
+        for name, array in arrays:
+            f.seek(start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+
+
+class MapBundle(object):
+    """
+    A compiled bundle (see `compile_bundle`) memory-mapped read-only. Arrays are views on the mapping, so all the
+    processes opening the same file share its memory. The maps built from the bundle read nodes, edges and
+    entrances from those views and copy an array only when they change it.
+
+    Bundles are context managers: leaving the context closes them (see `close`).
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._mmap[:len(MAGIC)] != MAGIC:
+                raise ValueError("Not a map bundle: " + path)
+            version, header_length = struct.unpack("<QQ", self._mmap[len(MAGIC):len(MAGIC) + 16])
+            if version != FORMAT_VERSION:
+                raise ValueError("Unsupported map bundle version: " + str(version))
+            header_start = len(MAGIC) + 16
+            self.header = json.loads(self._mmap[header_start:header_start + header_length].decode("utf-8"))
+            start = -(-(header_start + header_length) // ALIGNMENT) * ALIGNMENT
+            specs = [(name, np.dtype(spec["dtype"]), spec["shape"], start + spec["offset"])
+                     for name, spec in self.header["arrays"].items()]
+            for _, dtype, shape, offset in specs:
+                if offset + dtype.itemsize * int(np.prod(shape, dtype=np.int64)) > len(self._mmap):
+                    raise ValueError("Truncated map bundle: " + path)
+        except (ValueError, KeyError, TypeError, struct.error) as error:
+            self._mmap.close()
+            raise ValueError("Not a valid map bundle: {} ({})".format(path, error))
+        self.arrays = {}
+        for name, dtype, shape, offset in specs:
+            count = int(np.prod(shape, dtype=np.int64))
+            self.arrays[name] = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset).reshape(shape)
+        self._abstraction = None
+
+    def __getattr__(self, item):
+        arrays = self.__dict__.get("arrays", {})
+        if item in arrays:
+            return arrays[item]
+        raise AttributeError(item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Release the arrays and unmap the file. The maps built from the bundle must not be used any more.
+        :raise BufferError: If some arrays of the bundle are still referenced.
+        """
+        self.arrays = {}
+        self._abstraction = None
+        self._mmap.close()
+
+    def logical_map(self):
+        """
+        :return: A new LogicalMap on the bundle grid, with precomputed move masks.
+        :rtype: LogicalMap
+        """
+        return LogicalMap.from_arrays(self.grid, self.passable, self.move_masks)
+
+    def abstraction(self):
+        """
+        Return a frozen HierarchicalMap of the bundle. The abstraction is built once per bundle; every call returns
+        a new `cost_view` of it, so edge cost updates never affect other callers.
+        :rtype: HierarchicalMap
+        """
+        if self._abstraction is None:
+            graph = FrozenGraph.from_arrays(self.nodes, self.node_index, self.edge_nodes, self.offsets,
+                                            self.targets, self.slot_edges, self.costs, self.types,
+                                            self.header["type_names"])
+            cluster_entrances = ClusterIndex(self.cluster_nodes, self.cluster_offsets, self.cluster_vertical,
+                                             self.header["cluster_width"])
+            self._abstraction = HierarchicalMap.from_index(self.logical_map(), self.header["cluster_size"],
+                                                           EntranceArray(self.vertical),
+                                                           EntranceArray(self.horizontal), cluster_entrances, graph)
+        return self._abstraction.cost_view()
+
+    def random_free_cell(self, rng=None):
+        """
+        :param rng: An optional numpy.random.Generator.
+        :return: A uniformly chosen traversable (row, column).
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        return divmod(int(self.free_cells[rng.integers(len(self.free_cells))]), self.grid.shape[1])
+
+    def connected(self, first, second):
+        """
+        :return: True if there is a path between the two tiles.
+        """
+        first_label = self.component_labels[first[0], first[1]]
+        return first_label != 0 and first_label == self.component_labels[second[0], second[1]]
+
+
+class EntranceArray(object):
+    """
+    A read-only sequence of entrances, ((node, node), (cluster, cluster)), backed by an (n, 8) integer array.
+    """
+
+    def __init__(self, array):
+        self.array = array
+
+    @staticmethod
+    def _entrance(row):
+        return (tuple(row[0:2]), tuple(row[2:4])), (tuple(row[4:6]), tuple(row[6:8]))
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, item):
+        return self._entrance(self.array[item].tolist())
+
+    def __iter__(self):
+        return (self._entrance(row) for row in self.array.tolist())
+
+
+class ClusterIndex(object):
+    """
+    A read-only mapping from every cluster to the pair (vertical entrance nodes, horizontal entrance nodes), the
+    cluster index of HierarchicalMap. It is backed by the entrance nodes of all the clusters in row-major order,
+    the offsets of every cluster among them and the number of its vertical entrance nodes.
+    """
+
+    def __init__(self, nodes, offsets, vertical_counts, cluster_width):
+        self.nodes = TileArray(nodes)
+        self.offsets = offsets
+        self.vertical_counts = vertical_counts
+        self.cluster_width = cluster_width
+
+    def get(self, cluster, default=None):
+        i, j = cluster
+        index = i * self.cluster_width + j
+        if not (0 <= j < self.cluster_width and 0 <= index < len(self.vertical_counts)):
+            return default
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        if start == end:
+            return default
+        split = start + int(self.vertical_counts[index])
+        return [self.nodes[x] for x in range(start, split)], [self.nodes[x] for x in range(split, end)]
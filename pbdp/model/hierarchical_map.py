@@ -2,30 +2,56 @@
 Contains the algorithm for the map decomposition.
 """
 
+import copy
 import math
 import itertools
+import multiprocessing
+from collections import OrderedDict
+from heapq import heappush, heappop
+
+import numpy as np
 
 from pbdp.bdpcollections.graph import Graph, ExtendedGraph
-from pbdp.model.map import LogicalMap, distance_euclidean
+from pbdp.bdpcollections.frozen_graph import FrozenGraph
+from pbdp.model.map import MASK_MOVES, move_masks
+
+# Source of abstraction versions. Versions are unique among all the maps, so caches can use them as keys.
+_versions = itertools.count()
+
+# Version of the abstraction builder. Increment it when `generate_abstract_graph` builds a different graph, so
+# that saved abstractions (see `HierarchicalMap.save`) are built again.
+BUILDER_VERSION = 1
+
+# Edge types, in the order of the codes used in saved abstractions.
+EDGE_TYPES = ('inter', 'intra')
 
 
 class HierarchicalMap(object):
     ENTRANCE_POSITION = 0
     ENTRANCE_CLUSTERS = 1
+    CONNECTION_CACHE_SIZE = 4096  # Most recently used tiles whose connections are cached (see `cell_connections`).
 
-    def __init__(self, original_map, div_amount):
+    def __init__(self, original_map, div_amount=None, cluster_size=None):
         """
         Constructor
         :param original_map:
         :type original_map LogicalMap
-        :param div_amount:
+        :param div_amount: The side of the clusters, as a fraction of the map width.
+        :param cluster_size: The side of the clusters, in tiles. It is used in place of div_amount.
         :return:
         """
         self.original_map = original_map
         self.vertical_entrances = []  # List of tuples -> ( (node1,node2), (cluster1, cluster2) )
         self.horizontal_entrances = []
-        self.cluster_size = int(math.ceil(original_map.width * div_amount))
+        self._cluster_entrances = {}  # Cluster -> (vertical entrance nodes, horizontal entrance nodes)
+        if cluster_size is None:
+            cluster_size = int(math.ceil(original_map.width * div_amount))
+        self.cluster_size = cluster_size
         self.abstraction_graph = Graph()
+        self.version = next(_versions)  # Changes every time the abstraction changes.
+        self.structure_version = self.version  # Changes when the entrances change, not when edge costs do.
+        self._frozen_view = None
+        self._connections = OrderedDict()  # (structure version, map version, tile) -> (entrances, costs). Shared.
 
     def _round_to_clusters(self, value):
         return int(math.ceil(value / float(self.cluster_size)))
@@ -60,7 +86,7 @@ class HierarchicalMap(object):
         """
         start, end = edge if isinstance(edge[0], tuple) else (edge, end)
         edge = (start, end)
-        return edge in self.abstraction_graph.edges and \
+        return self.abstraction_graph.is_adjacent(start, end) and \
                self.abstraction_graph.get_edge_label(edge)["type"] == 'inter'
 
     def update_edge_cost(self, edge, new_cost):
@@ -73,6 +99,7 @@ class HierarchicalMap(object):
         new_label = old_label.copy()
         new_label["cost"] = new_cost
         self.abstraction_graph.update_edge_label(edge, new_label)
+        self.version = next(_versions)
 
     def close_edge(self, edge):
         """
@@ -99,12 +126,131 @@ class HierarchicalMap(object):
         """
         return self.abstraction_graph.edges
 
+    @property
+    def inter_edges(self):
+        """
+        :return: Returns all the 'inter' edges of the map, each undirected edge exactly once.
+        """
+        return (edge for edge in self.abstraction_graph.canonical_edges if self.is_edge_type(edge, 'inter'))
+
     def is_node(self, node):
-        return node in self.abstraction_graph.vertices
+        return node in self.abstraction_graph
+
+    @property
+    def is_frozen(self):
+        return isinstance(self.abstraction_graph, FrozenGraph)
+
+    def cost_view(self):
+        """
+        Return a lightweight copy of the map to use in place of a deep copy when only edge costs change (e.g.,
+        closing edges). The view shares the grid, the entrances and the abstraction structure with this map and
+        stores only the edge costs changed through it. Changing the view never affects this map.
+        :return: The new view.
+        :rtype: HierarchicalMap
+        """
+        view = copy.copy(self)
+        view.abstraction_graph = self.abstraction_graph.cost_overlay()
+        return view
+
+    def freeze(self):
+        """
+        Replace the abstraction graph with a compact read-only snapshot (see FrozenGraph). Edge costs can
+        still be updated, but the abstraction can not be generated again.
+        :return: self
+        """
+        if not self.is_frozen:
+            self.abstraction_graph = FrozenGraph(self.abstraction_graph)
+        return self
+
+    def frozen_view(self):
+        """
+        Return a frozen copy of the map (see `freeze`) sharing the grid and the entrances with this map. The copy
+        is built once and reused until the abstraction changes. A frozen map returns itself.
+        :rtype: HierarchicalMap
+        """
+        if self.is_frozen:
+            return self
+        if self._frozen_view is None or self._frozen_view[0] != self.version:
+            frozen = copy.copy(self)
+            frozen._frozen_view = None
+            self._frozen_view = (self.version, frozen.freeze())
+        return self._frozen_view[1]
+
+    ## PERSISTENCE ##
+
+    def save(self, path):
+        """
+        Save the entrances and the abstraction graph (with the current edge costs) in a binary ".npz" file.
+        :param path: The destination path. It should end with ".npz".
+        """
+        def entrance_array(entrances):
+            return np.array([nodes[0] + nodes[1] + clusters[0] + clusters[1] for nodes, clusters in entrances],
+                            dtype=np.int32).reshape(-1, 8)
+
+        graph = self.abstraction_graph
+        edges = list(graph.canonical_edges)
+        labels = [graph.get_edge_label(edge) for edge in edges]
+        np.savez(path,
+                 header=np.array([BUILDER_VERSION, self.cluster_size, self.original_map.height,
+                                  self.original_map.width], dtype=np.int64),
+                 vertical=entrance_array(self.vertical_entrances),
+                 horizontal=entrance_array(self.horizontal_entrances),
+                 edges=np.array([edge[0] + edge[1] for edge in edges], dtype=np.int32).reshape(-1, 4),
+                 costs=np.array([label["cost"] for label in labels], dtype=np.float64),
+                 types=np.array([EDGE_TYPES.index(label["type"]) for label in labels], dtype=np.int8))
+
+    @classmethod
+    def load(cls, original_map, path):
+        """
+        Load an abstraction saved by `save`.
+        :param original_map: The map of the abstraction.
+        :type original_map LogicalMap
+        :param path: The source path.
+        :return: The HierarchicalMap.
+        :raise ValueError: If the file was saved by another builder version or for a map of another size.
+        """
+        with np.load(path) as data:
+            version, cluster_size, height, width = data["header"].tolist()
+            if version != BUILDER_VERSION or (height, width) != (original_map.height, original_map.width):
+                raise ValueError("The saved abstraction does not match the map or the builder version.")
+            abstraction = cls(original_map, cluster_size=cluster_size)
+            for vertical in (True, False):
+                for row in data["vertical" if vertical else "horizontal"].tolist():
+                    abstraction._add_entrance(((tuple(row[0:2]), tuple(row[2:4])),
+                                               (tuple(row[4:6]), tuple(row[6:8]))), vertical)
+            for edge, cost, type_code in zip(data["edges"].tolist(), data["costs"].tolist(), data["types"].tolist()):
+                abstraction.abstraction_graph.add_edge(tuple(edge[0:2]), tuple(edge[2:4]),
+                                                       meta={"type": EDGE_TYPES[type_code], "cost": cost})
+        return abstraction
+
+    @classmethod
+    def from_index(cls, original_map, cluster_size, vertical_entrances, horizontal_entrances, cluster_entrances,
+                   abstraction_graph):
+        """
+        Build a frozen abstraction on existing containers, without copying them (e.g., the array-backed ones of a
+        MapBundle).
+        :param vertical_entrances: The sequence of the vertical entrances.
+        :param horizontal_entrances: The sequence of the horizontal entrances.
+        :param cluster_entrances: A mapping, with a `get` method, from every cluster to the pair (vertical entrance
+                                  nodes, horizontal entrance nodes).
+        :param abstraction_graph: The FrozenGraph of the abstraction.
+        :rtype: HierarchicalMap
+        """
+        abstraction = cls(original_map, cluster_size=cluster_size)
+        abstraction.vertical_entrances = vertical_entrances
+        abstraction.horizontal_entrances = horizontal_entrances
+        abstraction._cluster_entrances = cluster_entrances
+        abstraction.abstraction_graph = abstraction_graph
+        return abstraction
 
     ## ABSTRACTION GENERATION ##
 
-    def generate_abstract_graph(self):
+    def generate_abstract_graph(self, workers=None):
+        """
+        Build the abstraction graph.
+        :param workers: If greater than 1, the intra edge costs of the clusters are computed by a pool of worker
+                        processes of this size.
+        """
         # Find Entrances
         self.__search_for_entrances()
 
@@ -112,30 +258,152 @@ class HierarchicalMap(object):
         self.__connect_inter_nodes()
 
         # Add connection between entrance nodes of the same cluster.
-        self.__connect_intra_nodes()
+        self.__connect_intra_nodes(workers)
+
+        self.version = self.structure_version = next(_versions)
+
+    def update_tiles(self, changed_cells):
+        """
+        Update the abstraction after some tiles of the original map changed (see `LogicalMap.set_tile`).
+
+        Only the entrances on the cluster borders crossed by the changed tiles and the intra edges of the clusters
+        touching those tiles or borders are computed again. The abstraction graph is patched in place.
+        :param changed_cells: The (row, column) of the changed tiles.
+        :return: A dictionary with the lists of the 'added', 'removed' and 'changed' (in cost) edges.
+        """
+        if self.is_frozen:
+            raise TypeError("A frozen abstraction can not be updated.")
+        size = self.cluster_size
+        borders = set()  # (first cluster, second cluster, True for vertical borders)
+        clusters = set()
+        for r, c in changed_cells:
+            i, j = self.get_tile_cluster((r, c))
+            clusters.add((i, j))
+            if c % size == size - 1 and j + 1 < self.cluster_width:
+                borders.add(((i, j), (i, j + 1), True))
+            if c % size == 0 and j > 0:
+                borders.add(((i, j - 1), (i, j), True))
+            if r % size == size - 1 and i + 1 < self.cluster_height:
+                borders.add(((i, j), (i + 1, j), False))
+            if r % size == 0 and i > 0:
+                borders.add(((i - 1, j), (i, j), False))
+        for first, second, _ in borders:
+            clusters.update((first, second))
+        border_clusters = set((first, second) for first, second, _ in borders)
+
+        old_edges = self.__local_edges(clusters, border_clusters)
+        for edge, _ in old_edges.values():
+            self.abstraction_graph.remove_edge(*edge)
+
+        # Detect the entrances of the affected borders again.
+        self.vertical_entrances = [x for x in self.vertical_entrances
+                                   if x[self.ENTRANCE_CLUSTERS] not in border_clusters]
+        self.horizontal_entrances = [x for x in self.horizontal_entrances
+                                     if x[self.ENTRANCE_CLUSTERS] not in border_clusters]
+        self._cluster_entrances = {}
+        for entrance in self.vertical_entrances:
+            self._index_entrance(entrance, True)
+        for entrance in self.horizontal_entrances:
+            self._index_entrance(entrance, False)
+        for first, second, vertical in sorted(borders):
+            if vertical:
+                self.find_vertical_entrances(first, second)
+            else:
+                self.find_horizontal_entrances(first, second)
+
+        for e in itertools.chain(self.vertical_entrances, self.horizontal_entrances):
+            if e[self.ENTRANCE_CLUSTERS] in border_clusters:
+                self.abstraction_graph.add_edge(e[0][0], e[0][1], meta={"type": "inter", "cost": 1})
+        self.__connect_intra_nodes(clusters=sorted(clusters))
+
+        # Drop the nodes of the entrances that disappeared.
+        for edge, _ in old_edges.values():
+            for node in edge:
+                if node in self.abstraction_graph and not self.abstraction_graph.neighbours(node):
+                    self.abstraction_graph.remove_node(node)
+
+        new_edges = self.__local_edges(clusters, border_clusters)
+        self.version = self.structure_version = next(_versions)
+        return {'added': [new_edges[x][0] for x in new_edges if x not in old_edges],
+                'removed': [old_edges[x][0] for x in old_edges if x not in new_edges],
+                'changed': [new_edges[x][0] for x in new_edges if x in old_edges and
+                            not math.isclose(old_edges[x][1], new_edges[x][1], abs_tol=1e-9)]}
+
+    def __local_edges(self, clusters, border_clusters):
+        """
+        Collect the inter edges of the entrances between the given pairs of clusters and the intra edges of the
+        given clusters.
+        :return: A dictionary from the edge, with its nodes sorted, to the (edge, cost) pair.
+        """
+        graph = self.abstraction_graph
+        edges = []
+        for e in itertools.chain(self.vertical_entrances, self.horizontal_entrances):
+            if e[self.ENTRANCE_CLUSTERS] in border_clusters and graph.is_adjacent(*e[self.ENTRANCE_POSITION]):
+                edges.append(graph.canonical_edge(e[self.ENTRANCE_POSITION]))
+        for cluster in clusters:
+            for pair in itertools.combinations(self.get_all_in_cluster(cluster), 2):
+                if graph.is_adjacent(*pair) and graph.get_edge_label(pair)["type"] == "intra":
+                    edges.append(graph.canonical_edge(pair))
+        return dict((tuple(sorted(edge)), (edge, graph.get_edge_label(edge)["cost"])) for edge in edges)
 
     def get_all_in_cluster(self, cluster):
         """
-        Return all the entrance nodes in the given cluster
+        Return all the entrance nodes in the given cluster: the ones of the vertical entrances first, then the
+        ones of the horizontal entrances, in detection order.
         :param cluster:
         :return:
         """
+        vertical_pos, horizontal_pos = self._cluster_entrances.get(tuple(cluster), ((), ()))
+        return list(vertical_pos) + list(horizontal_pos)
+
+    def cell_connections(self, cell):
+        """
+        Return the entrances of the cluster of a tile that can be reached from the tile moving inside the cluster,
+        with the costs of the shortest paths (see `cell_entrance_costs`).
 
-        def get_from_vector(vec):
-            result = []
-            for entrances in vec:
-                x_position = entrances[self.ENTRANCE_POSITION]
-                x_clusters = entrances[self.ENTRANCE_CLUSTERS]
-                if cluster == x_clusters[0]:
-                    result.append(x_position[0])
-                if cluster == x_clusters[1]:
-                    result.append(x_position[1])
-            return result
+        The costs depend only on the grid and on the entrances, so results are cached until one of them changes
+        (`structure_version` and the map version); edge cost updates keep them. The cache is shared with the
+        copies returned by `cost_view` and `frozen_view`, so replanning from the same tiles computes nothing. Beyond
+        CONNECTION_CACHE_SIZE tiles, the least recently used ones are evicted.
+        :param cell: The (row, column) of the tile.
+        :return: A pair of lists (entrances, costs).
+        """
+        cell = tuple(cell)
+        key = (self.structure_version, self.original_map.version, cell)
+        connections = self._connections.get(key)
+        if connections is not None:
+            self._connections.move_to_end(key)
+        else:
+            entrances = self.get_all_in_cluster(self.get_tile_cluster(cell))
+            row, col, end_row, end_col = self.cluster_bounds(self.get_tile_cluster(cell))
+            costs = cell_entrance_costs(self.original_map.passable[row:end_row, col:end_col],
+                                        (cell[0] - row, cell[1] - col), [(r - row, c - col) for r, c in entrances])
+            reachable = [(x, cost) for x, cost in zip(entrances, costs) if cost < float('inf')]
+            connections = ([x for x, _ in reachable], [cost for _, cost in reachable])
+            while len(self._connections) >= self.CONNECTION_CACHE_SIZE:
+                self._connections.popitem(last=False)
+            self._connections[key] = connections
+        return connections
+
+    def _add_entrance(self, entrance, vertical):
+        """
+        Record a new entrance in the entrance lists and in the cluster index.
+        """
+        (self.vertical_entrances if vertical else self.horizontal_entrances).append(entrance)
+        self._index_entrance(entrance, vertical)
 
-        vertical_pos = get_from_vector(self.vertical_entrances)
-        horizontal_pos = get_from_vector(self.horizontal_entrances)
-        return vertical_pos + horizontal_pos
+    def _index_entrance(self, entrance, vertical):
+        for node, cluster in zip(entrance[self.ENTRANCE_POSITION], entrance[self.ENTRANCE_CLUSTERS]):
+            self._cluster_entrances.setdefault(cluster, ([], []))[0 if vertical else 1].append(node)
 
+    def cluster_bounds(self, cluster):
+        """
+        :return: The (first row, first column, end row, end column) of the tiles of the given cluster. End values
+                 are excluded.
+        """
+        row, col = cluster[0] * self.cluster_size, cluster[1] * self.cluster_size
+        return row, col, min(row + self.cluster_size, self.original_map.height), \
+            min(col + self.cluster_size, self.original_map.width)
 
     def get_tile_cluster(self, coord):
         """
@@ -175,8 +443,8 @@ class HierarchicalMap(object):
                 cluster_row_current += 1
             node_row_exit = cluster_row_current
             middle_row_node = int((node_row_exit + node_row_entrance) / 2)
-            self.vertical_entrances.append(
-                (((middle_row_node, cluster_col), (middle_row_node, cluster_col + 1)), (first, second)))
+            self._add_entrance(
+                (((middle_row_node, cluster_col), (middle_row_node, cluster_col + 1)), (first, second)), True)
 
     def first_or_second(self, first, second, position):
         """
@@ -218,8 +486,8 @@ class HierarchicalMap(object):
                 cluster_col_current += 1
             node_col_exit = cluster_col_current
             middle_node = int((node_col_exit + node_col_start) / 2)
-            self.horizontal_entrances.append(
-                (((cluster_row, middle_node), (cluster_row + 1, middle_node)), (first, second)))
+            self._add_entrance(
+                (((cluster_row, middle_node), (cluster_row + 1, middle_node)), (first, second)), False)
 
     def __booth_free(self, left_tile, right_tile):
         # Assume all the keys = all doors open.
@@ -230,13 +498,30 @@ class HierarchicalMap(object):
         for e in itertools.chain(self.vertical_entrances, self.horizontal_entrances):
             self.abstraction_graph.add_edge(e[0][0], e[0][1], meta={"type": "inter", "cost": 1})
 
-    def __connect_intra_nodes(self):
-        for i in range(0, self.cluster_height):
-            for j in range(0, self.cluster_width):
-                for e in itertools.combinations(self.get_all_in_cluster((i, j)), 2):
-                    cost = distance_euclidean(e[0], e[1])
-                    if cost is not None:
-                        self.abstraction_graph.add_edge(e[0], e[1], meta={"type": "intra", "cost": cost})
+    def __connect_intra_nodes(self, workers=None, clusters=None):
+        if clusters is None:
+            clusters = list(itertools.product(range(self.cluster_height), range(self.cluster_width)))
+        cluster_entrances = [self.get_all_in_cluster(cluster) for cluster in clusters]
+        tasks = []
+        for cluster, entrances in zip(clusters, cluster_entrances):
+            row, col, end_row, end_col = self.cluster_bounds(cluster)
+            tasks.append((self.original_map.passable[row:end_row, col:end_col],
+                          [(r - row, c - col) for r, c in entrances]))
+        if workers is not None and workers > 1:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            pool = context.Pool(workers)
+            try:
+                results = pool.map(cluster_entrance_costs, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [cluster_entrance_costs(task) for task in tasks]
+        for entrances, costs in zip(cluster_entrances, results):
+            for e, cost in zip(itertools.combinations(entrances, 2), costs):
+                if cost < float('inf'):
+                    self.abstraction_graph.add_edge(e[0], e[1], meta={"type": "intra", "cost": cost})
 
     def __search_for_entrances(self):
         for i in range(0, self.cluster_height):
@@ -247,6 +532,170 @@ class HierarchicalMap(object):
                 self.find_horizontal_entrances((i, j), (i + 1, j))
 
 
+def cluster_entrance_costs(task):
+    """
+    Compute the costs of the shortest paths between the entrances of a cluster, moving only inside the cluster.
+    A Dijkstra search runs from every entrance and stops once the entrances with a higher cell index are settled.
+    :param task: A pair (passable, entrances): the boolean array of the traversable tiles of the cluster and the
+                 list of the entrances, in coordinates relative to the cluster.
+    :return: The list of the costs of all the pairs of entrances, in the order of `itertools.combinations`.
+             Disconnected pairs cost infinite.
+    """
+    passable, entrances = task
+    width = passable.shape[1]
+    masks = move_masks(passable).ravel().tolist()
+    mask_steps = [[(dr * width + dc, cost) for dr, dc, cost in moves] for moves in MASK_MOVES]
+    cells = [r * width + c for r, c in entrances]
+    # Searches start from the lower cell of every pair, so costs do not depend on the order of the entrances.
+    sources = sorted(set(cells))
+    pair_costs = {}
+    for i, source in enumerate(sources):
+        distances = _cell_distances(masks, mask_steps, source, sources[i:])
+        for target in sources[i:]:
+            pair_costs[(source, target)] = distances.get(target, float('inf'))
+    return [pair_costs[(min(a, b), max(a, b))] for a, b in itertools.combinations(cells, 2)]
+
+
+def _cell_distances(masks, mask_steps, source, targets):
+    """
+    Dijkstra search on the flat cells of a cluster. It stops once all the targets are settled.
+    :return: The dictionary of the settled cells and their distances from the source.
+    """
+    targets = set(targets)
+    distances = {}
+    openlist = [(0.0, source)]
+    while openlist and targets:
+        g, current = heappop(openlist)
+        if current in distances:
+            continue
+        distances[current] = g
+        targets.discard(current)
+        for step, cost in mask_steps[masks[current]]:
+            a = current + step
+            if a not in distances:
+                heappush(openlist, (g + cost, a))
+    return distances
+
+
+def cell_entrance_costs(passable, cell, entrances):
+    """
+    Compute the costs of the shortest paths from a tile to the entrances of its cluster, moving only inside the
+    cluster. It is the counterpart of `cluster_entrance_costs` for a single source.
+    :param passable: The boolean array of the traversable tiles of the cluster.
+    :param cell: The tile, in coordinates relative to the cluster.
+    :param entrances: The list of the entrances, in coordinates relative to the cluster.
+    :return: The list of the costs of the entrances, in the same order. Unreachable entrances cost infinite.
+    """
+    width = passable.shape[1]
+    masks = move_masks(passable).ravel().tolist()
+    mask_steps = [[(dr * width + dc, cost) for dr, dc, cost in moves] for moves in MASK_MOVES]
+    cells = [r * width + c for r, c in entrances]
+    distances = _cell_distances(masks, mask_steps, cell[0] * width + cell[1], cells)
+    return [distances.get(x, float('inf')) for x in cells]
+
+
+class MultiLevelMap(object):
+    """
+    A stack of abstraction levels over the same map.
+
+    `levels[0]` is a HierarchicalMap of the grid. Every level above is a HierarchicalMap whose clusters group
+    `factor` x `factor` clusters of the level below: its entrances are the entrances of the level below crossing
+    its cluster borders, and its intra edges cost the shortest path between them in the graph of the level
+    below, moving only inside the cluster. The stack stops early if a level has no entrances.
+
+    Searches start from the top level and are refined level by level (see `hpa_high_level`).
+    """
+
+    def __init__(self, original_map, div_amount, levels=2, factor=2):
+        """
+        :param original_map:
+        :type original_map LogicalMap
+        :param div_amount: The cluster size of the first level, as a fraction of the map width.
+        :param levels: The maximum number of levels.
+        :param factor: The number of clusters of a level merged, along each side, in a cluster of the next level.
+        """
+        self.original_map = original_map
+        self.level_count = levels
+        self.factor = factor
+        self.levels = [HierarchicalMap(original_map, div_amount)]
+
+    @property
+    def version(self):
+        return tuple(level.version for level in self.levels)
+
+    @property
+    def structure_version(self):
+        return tuple(level.structure_version for level in self.levels)
+
+    @property
+    def is_frozen(self):
+        return False
+
+    def is_node(self, node):
+        return self.levels[0].is_node(node)
+
+    def generate_abstract_graph(self, workers=None):
+        """
+        Build the first level (see `HierarchicalMap.generate_abstract_graph`) and the levels above it.
+        """
+        self.levels = self.levels[:1]
+        self.levels[0].generate_abstract_graph(workers)
+        while len(self.levels) < self.level_count:
+            level = self._build_level(self.levels[-1])
+            if not (level.vertical_entrances or level.horizontal_entrances):
+                break
+            self.levels.append(level)
+
+    def _build_level(self, lower):
+        level = HierarchicalMap(self.original_map, cluster_size=lower.cluster_size * self.factor)
+        lower_graph = lower.abstraction_graph
+        for vertical, entrances in ((True, lower.vertical_entrances), (False, lower.horizontal_entrances)):
+            for nodes, _ in entrances:
+                clusters = tuple(level.get_tile_cluster(x) for x in nodes)
+                if clusters[0] != clusters[1]:
+                    level._add_entrance((nodes, clusters), vertical)
+                    level.abstraction_graph.add_edge(nodes[0], nodes[1],
+                                                     meta=dict(lower_graph.get_edge_label(nodes)))
+        for cluster in itertools.product(range(level.cluster_height), range(level.cluster_width)):
+            entrances = level.get_all_in_cluster(cluster)
+            inside = lambda x: level.get_tile_cluster(x) == cluster
+            costs = graph_entrance_costs(lower_graph, entrances, inside)
+            for e, cost in zip(itertools.combinations(entrances, 2), costs):
+                if cost < float('inf'):
+                    level.abstraction_graph.add_edge(e[0], e[1], meta={"type": "intra", "cost": cost})
+        level.version = level.structure_version = next(_versions)
+        return level
+
+
+def graph_entrance_costs(graph, entrances, inside):
+    """
+    Compute the costs of the shortest paths between some nodes of an abstraction graph, moving only through the
+    nodes accepted by `inside`. It is the counterpart of `cluster_entrance_costs` for the levels above the grid.
+    :param graph: The abstraction graph.
+    :param entrances: The list of the nodes.
+    :param inside: A predicate on nodes.
+    :return: The list of the costs of all the pairs of nodes, in the order of `itertools.combinations`.
+    """
+    sources = sorted(set(entrances))
+    pair_costs = {}
+    for i, source in enumerate(sources):
+        targets = set(sources[i:])
+        distances = {}
+        openlist = [(0.0, source)]
+        while openlist and targets:
+            g, current = heappop(openlist)
+            if current in distances:
+                continue
+            distances[current] = g
+            targets.discard(current)
+            for a in graph.neighbours(current):
+                if a not in distances and inside(a):
+                    heappush(openlist, (g + graph.get_edge_label((current, a))["cost"], a))
+        for target in sources[i:]:
+            pair_costs[(source, target)] = distances.get(target, float('inf'))
+    return [pair_costs[(min(a, b), max(a, b))] for a, b in itertools.combinations(entrances, 2)]
+
+
 class ExtendedAbstraction(object):
     """
     This is a persistent abstraction used to represent an extended Hierarchical Map with two more
@@ -270,10 +719,10 @@ class ExtendedAbstraction(object):
         self.start_cluster = self.original_abstraction.get_tile_cluster(start)
         self.end = end
         self.end_cluster = self.original_abstraction.get_tile_cluster(end)
-        start_connection = self.original_abstraction.get_all_in_cluster(self.start_cluster)
-        start_labels = [{"type": "intra", "cost": distance_euclidean(start, x)} for x in start_connection]
-        end_connection = self.original_abstraction.get_all_in_cluster(self.end_cluster)
-        end_labels = [{"type": "intra", "cost": distance_euclidean(end, x)} for x in end_connection]
+        start_connection, start_costs = self.original_abstraction.cell_connections(start)
+        start_labels = [{"type": "intra", "cost": x} for x in start_costs]
+        end_connection, end_costs = self.original_abstraction.cell_connections(end)
+        end_labels = [{"type": "intra", "cost": x} for x in end_costs]
         self.extended_graph = ExtendedGraph(abstraction.abstraction_graph)
         self.extended_graph.add_extended_node(start, start_connection, start_labels)
         self.extended_graph.add_extended_node(end, end_connection, end_labels)
@@ -302,7 +751,7 @@ class ExtendedAbstraction(object):
                self.extended_graph.get_edge_label((start, end))["cost"] < float('inf')
 
     def _is_node(self, node):
-        return node in self.extended_graph.vertices
+        return node in self.extended_graph
 
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
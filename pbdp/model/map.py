@@ -2,37 +2,136 @@ __author__ = 'davide'
 
 import math
 
+import numpy as np
+
 from pbdp.model.vector2d import Vec2d
 
+# The eight moves of a tile, as (row, column) deltas. Bit k of a move mask is set if move k is legal.
+MOVES = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+MOVE_COSTS = tuple(math.sqrt(2) if dr and dc else 1 for dr, dc in MOVES)
+MOVE_INDEX = dict((move, k) for k, move in enumerate(MOVES))
+
+# For every mask value, the tuple of the (row delta, column delta, cost) of its legal moves.
+MASK_MOVES = tuple(tuple((dr, dc, cost) for k, ((dr, dc), cost) in enumerate(zip(MOVES, MOVE_COSTS)) if mask >> k & 1)
+                   for mask in range(256))
+
 
 class LogicalMap(object):
-    def __init__(self, map_path):
+    """
+    A grid map in the MovingAI format.
+
+    The tiles are stored in `grid`, a (height, width) uint8 NumPy array of the tile characters, and `passable`
+    is the boolean array of the traversable tiles. A map can also be loaded from the binary file written by
+    `save_binary` (a ".npy" file): the grid is then memory-mapped instead of being read in memory.
+
+    `precompute_moves` stores in `move_masks` the legal moves of every tile (see `MOVES`), with corner cutting
+    already resolved. From then on `neighbours` and `cost` are table lookups.
+    """
+
+    TRAVERSABLE = b"."
+
+    def __init__(self, map_path, precompute_moves=False):
         def read_map(_map_path):
             """
-            Internal. Generates matrix. Initialises info and populates costs.
-            Called from init. Sets matrix to None if map load fails.
-            Differentiates between uniform and non-uniform cost based on length
-            map header.
+            Internal. Parse the map header and return it with the (height, width) uint8 grid of the tiles.
 
             :type _map_path String
             """
             info = {}
-            with open(_map_path, "r") as f:
+            with open(_map_path, "rb") as f:
                 print("Parsing...")
                 for line in f:
-                    if line.strip() == 'map':
+                    if line.strip() == b'map':
                         break
                     parsed = line.split()
-                    key, value = parsed[0], parsed[1]
+                    key, value = parsed[0].decode(), parsed[1].decode()
                     info[key] = value
-                info["map"] = [list(line.rstrip()) for line in f]
-                return info
+                body = f.read().replace(b"\r", b"")
+            height, width = int(info["height"]), int(info["width"])
+            size = height * (width + 1)
+            if len(body) >= size:
+                rows = np.frombuffer(body, dtype=np.uint8, count=size).reshape(height, width + 1)
+                if (rows[:, width] == ord("\n")).all():
+                    return info, rows[:, :width].copy()
+            # Slow path: ragged lines or a missing final newline.
+            grid = np.full((height, width), ord(" "), dtype=np.uint8)
+            for r, line in enumerate(body.split(b"\n")[:height]):
+                line = line.rstrip()[:width]
+                grid[r, :len(line)] = np.frombuffer(line, dtype=np.uint8)
+            return info, grid
+
+        if map_path.endswith(".npy"):
+            self.grid = np.load(map_path, mmap_mode="r")
+        else:
+            self.grid = read_map(map_path)[1]
+        self.height, self.width = self.grid.shape
+        self.passable = self.grid == ord(self.TRAVERSABLE)
+        self.move_masks = None
+        self.version = 0  # Incremented at every change of the tiles.
+        if precompute_moves:
+            self.precompute_moves()
+
+    def precompute_moves(self):
+        """
+        Compute the (height, width) uint8 array of the move masks of all the tiles. A move is legal if both its
+        ends are traversable and, for diagonal moves, both the tiles next to the corner are traversable too.
+        """
+        self.move_masks = move_masks(self.passable)
 
-        map_parsed = read_map(map_path)
+    @classmethod
+    def from_arrays(cls, grid, passable=None, masks=None):
+        """
+        Build a map on existing arrays, without copying them (e.g., arrays memory-mapped from a bundle).
+        :param grid: The (height, width) uint8 array of the tile characters.
+        :param passable: The boolean array of the traversable tiles. It is computed if missing.
+        :param masks: The optional move masks (see `precompute_moves`).
+        :rtype: LogicalMap
+        """
+        logical_map = cls.__new__(cls)
+        logical_map.grid = grid
+        logical_map.height, logical_map.width = grid.shape
+        logical_map.passable = grid == ord(cls.TRAVERSABLE) if passable is None else passable
+        logical_map.move_masks = masks
+        logical_map.version = 0
+        return logical_map
+
+    def set_tile(self, tile, value):
+        """
+        Change a tile of the map, keeping the passable array and the move masks up to date.
+        :param tile: The (row, column) of the tile.
+        :param value: The new tile character.
+        """
+        r, c = tile[0], tile[1]
+        if not self.grid.flags.writeable:
+            self.grid = np.array(self.grid)  # Copy read-only (memory-mapped) arrays on the first change.
+        if not self.passable.flags.writeable:
+            self.passable = np.array(self.passable)
+        if self.move_masks is not None and not self.move_masks.flags.writeable:
+            self.move_masks = np.array(self.move_masks)
+        self.grid[r, c] = ord(value)
+        self.passable[r, c] = value == self.TRAVERSABLE.decode()
+        if self.move_masks is not None:
+            # Only the masks of the tile and of its neighbours change. They depend on tiles up to 2 steps away.
+            top, left = max(r - 2, 0), max(c - 2, 0)
+            masks = move_masks(self.passable[top:r + 3, left:c + 3])
+            first_row, first_col = max(r - 1, 0), max(c - 1, 0)
+            self.move_masks[first_row:r + 2, first_col:c + 2] = \
+                masks[first_row - top:r + 2 - top, first_col - left:c + 2 - left]
+        self.version += 1
+
+    def save_binary(self, path):
+        """
+        Save the grid as a ".npy" file. Passing that file to the constructor memory-maps it.
+        :param path: The destination path.
+        """
+        np.save(path, np.asarray(self.grid))
 
-        self.height = int(map_parsed["height"])
-        self.width = int(map_parsed["width"])
-        self.matrix = map_parsed["map"]
+    @property
+    def matrix(self):
+        """
+        :return: The map as a list of rows, each a list of tile characters.
+        """
+        return [list(row.tobytes().decode("ascii")) for row in self.grid]
 
     def cost(self, start, end):
         """
@@ -42,22 +141,28 @@ class LogicalMap(object):
         :type start Vec2d
         :type end Vec2d
         """
-
-        if self.is_traversable(start) and self.is_traversable(end):
-            if start.is_diagonal_to(end):
+        sr, sc = start[0], start[1]
+        er, ec = end[0], end[1]
+        k = MOVE_INDEX.get((er - sr, ec - sc)) if self.move_masks is not None else None
+        if k is not None:
+            return MOVE_COSTS[k] if self.move_masks[sr, sc] >> k & 1 else float('inf')
+        passable = self.passable
+        if passable[sr, sc] and passable[er, ec]:
+            if abs(er - sr) == 1 and abs(ec - sc) == 1:
                 # diagonal move - need to check corner cutting
-                delta = end - start
-
-                # check corner cutting
-                if self.is_traversable(start + (delta.x, 0)) and self.is_traversable(start + (0, delta.y)):
+                if passable[er, sc] and passable[sr, ec]:
                     return 1 * math.sqrt(2)
             else:
                 return 1
         return float('inf')
 
     def neighbours(self, tile):
+        if self.move_masks is not None:
+            r, c = tile[0], tile[1]
+            return [Vec2d(r + dr, c + dc) for dr, dc, _ in MASK_MOVES[self.move_masks[r, c]]]
+        passable = self.passable
         return [Vec2d(i, j) for i in range(tile.x-1, tile.x+2) for j in range(tile.y-1, tile.y+2)
-            if (Vec2d(i, j) != tile and self.is_traversable(Vec2d(i, j)))]
+                if (i != tile.x or j != tile.y) and passable[i, j]]
 
     def __getitem__(self, item):
         if isinstance(item, Vec2d):
@@ -65,15 +170,38 @@ class LogicalMap(object):
             c = item.y
         else:
             r, c = item
-        return self.matrix[r][c]
+        return chr(self.grid[r, c])
 
     def enumerate(self):
         for r in range(self.height):
+            row = self.grid[r].tobytes().decode("ascii")
             for c in range(self.width):
-                yield (self.matrix[r][c], (r, c))
+                yield (row[c], (r, c))
 
     def is_traversable(self, tile):
-        return self[tile] in "."
+        return bool(self.passable[tile[0], tile[1]])
+
+
+def move_masks(passable):
+    """
+    Compute the move masks (see `MOVES`) of a grid. Moves leaving the grid are not legal.
+    :param passable: A (height, width) boolean array of the traversable tiles.
+    :return: The (height, width) uint8 array of the masks.
+    """
+    height, width = passable.shape
+    padded = np.zeros((height + 2, width + 2), dtype=bool)
+    padded[1:-1, 1:-1] = passable
+
+    def shifted(dr, dc):
+        return padded[1 + dr:1 + dr + height, 1 + dc:1 + dc + width]
+
+    masks = np.zeros((height, width), dtype=np.uint8)
+    for k, (dr, dc) in enumerate(MOVES):
+        legal = passable & shifted(dr, dc)
+        if dr and dc:
+            legal &= shifted(dr, 0) & shifted(0, dc)
+        masks |= legal.astype(np.uint8) << k
+    return masks
 
 
 def distance_euclidean(start, end):
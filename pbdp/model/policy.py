@@ -1,9 +1,18 @@
 __author__ = 'davide'
 
 class Policy(object):
+    """
+    A policy built from a set of rollout paths.
+
+    Besides the table of the paths, the policy keeps an index from (step, node) to the successors seen in the
+    paths at that step. For every successor the index stores the total count of the rollouts and the sum of their
+    costs (weighted by count), so scoring an action does not depend on the number of stored paths.
+    """
 
     def __init__(self):
         self._policy_table = {}
+        self._index = {}  # (step, node) -> {successor: [count, weighted cost]}
+        self._start = None
         self._current = None
         self._current_idx = 0
         self._delta_cost = 0
@@ -15,32 +24,37 @@ class Policy(object):
         An empty policy is a policy with no useful information.
         :return:
         """
-        return self._current_idx >= len(next(iter(self._policy_table.keys()))) - 1
+        current = self._start if self._current is None else self._current
+        return (self._current_idx, current) not in self._index
 
     def is_valid(self, test_position):
         return self._current == test_position
 
     def add_path(self, path):
         path_key = path.to_tuple()
-        if path_key in self._policy_table.keys():
+        if path_key in self._policy_table:
             count = self._policy_table[path_key]["count"] + 1
         else:
             count = 1
         self._policy_table[path_key] = {"cost": path.length, "count": count}
+        if len(path_key) < 2:
+            return
+        if self._start is None:
+            self._start = path_key[0]
+        for step in range(len(path_key) - 1):
+            successors = self._index.setdefault((step, path_key[step]), {})
+            stats = successors.setdefault(path_key[step + 1], [0, 0.0])
+            stats[0] += 1
+            stats[1] += path.length
 
     def next_action_score(self, destination):
         if self._current is None:
-            self._current = next(iter(self._policy_table.keys()))[0]
-        total_rollouts = 0
-        different_costs = []
-        for path in self._policy_table.keys():
-            if path[self._current_idx] == self._current and path[self._current_idx+1] == destination:
-                total_rollouts += self._policy_table[path]["count"]
-                different_costs.append((self._policy_table[path]["count"], self._policy_table[path]["cost"]))
-        if total_rollouts is not 0:
-            return sum([x[0]*x[1] for x in different_costs])/total_rollouts
-        else:
+            self._current = self._start
+        successors = self._index.get((self._current_idx, self._current))
+        if successors is None or destination not in successors:
             return float('inf')
+        count, weighted_cost = successors[destination]
+        return weighted_cost / count
 
     def expand_policy(self, action, cost):
         """
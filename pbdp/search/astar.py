@@ -1,7 +1,15 @@
 __author__ = 'davide'
 
+import math
+import weakref
+from array import array
 from heapq import heappush, heappop
 
+import numpy as np
+
+from pbdp.model.map import MASK_MOVES
+from pbdp.model.vector2d import Vec2d
+
 
 def astar(searchable, start, goal, heuristic, config=None):
     """ Performs A* over a searchable object.
@@ -17,11 +25,20 @@ def astar(searchable, start, goal, heuristic, config=None):
         * `goal`        : The goal state.
         * `heuristic`   : An heuristic function between any state and the goal.
         * `config`      : A configuration dictionary.
+
+    The configuration dictionary also accepts `engine`. On a LogicalMap, 'grid' runs `astar_grid` and 'jps' runs
+    `astar_jps`, with the same heuristic; the default, 'astar', is the generic search described above.
     """
 
     config = {} if config is None else config
     path_only = config['path_only'] if 'path_only' in config else False
     profile = config['profile'] if 'profile' in config else False
+    engine = config['engine'] if 'engine' in config else 'astar'
+
+    if engine in GRID_ENGINES:
+        return GRID_ENGINES[engine](searchable, start, goal, heuristic, config)
+    if engine != 'astar':
+        raise ValueError("Unknown search engine: " + str(engine))
 
     def _reconstruct(c, s, closed):
         """
@@ -87,3 +104,416 @@ def return_path(path_only, profile, profile_data, path, cost=0):
         return path, cost, profile_data  # 0 steps, empty self.path
     else:
         return path, cost
+
+
+def astar_indexed(searchable, start, goal, heuristic, config=None):
+    """ Performs A* over a searchable object whose states are the integers in `range(searchable.node_count)`.
+
+    An indexed searchable object exposes:
+
+        * `node_count`          : The number of states.
+        * `successors(state)`   : A function who returns the list of (adjacent state, cost) pairs of `state`.
+
+    Search bookkeeping lives in flat lists indexed by state, so the expansion loop does no hashing.
+    PARAMS and return values are the same of `astar`. The configuration dictionary also accepts:
+
+        * `expansions`  : A list. The search appends to it a (state, g) pair for every expanded state.
+    """
+
+    config = {} if config is None else config
+    path_only = config['path_only'] if 'path_only' in config else False
+    profile = config['profile'] if 'profile' in config else False
+    expansions = config['expansions'] if 'expansions' in config else None
+
+    profile_data = {'expanded': 0}
+
+    if start == goal:
+        return return_path(path_only, profile, profile_data, [start])
+
+    inf = float('inf')
+    g_score = [inf] * searchable.node_count
+    parent = [-1] * searchable.node_count
+    closed = bytearray(searchable.node_count)
+
+    g_score[start] = 0
+    openlist = [(heuristic(start, goal), 0, start)]
+    while openlist:
+        current_f, current_g, current = heappop(openlist)
+        if closed[current] or current_g > g_score[current] or current_g == inf:
+            continue
+
+        closed[current] = 1
+
+        if current == goal:
+            path = [current]
+            while current != start:
+                current = parent[current]
+                path.append(current)
+            return return_path(path_only, profile, profile_data, list(reversed(path)), current_f)
+
+        if profile:
+            profile_data['expanded'] += 1
+        if expansions is not None:
+            expansions.append((current, current_g))
+
+        for a, cost in searchable.successors(current):
+            adjg = current_g + cost
+            if adjg < g_score[a]:
+                g_score[a] = adjg
+                parent[a] = current
+                closed[a] = 0
+                heappush(openlist, (adjg + heuristic(a, goal), adjg, a))
+
+    return return_path(path_only, profile, profile_data, [])
+
+
+SQRT2 = math.sqrt(2)
+
+
+class GridAstar(object):
+    """ A* specialized for LogicalMap grids.
+
+    Cells are identified by their flat id `r * width + c`. Neighbours and move costs come from the move masks of
+    the map (see `LogicalMap.precompute_moves`), so the search follows the same no-corner-cutting rule of
+    `LogicalMap.cost`. The g-score and parent arrays are allocated once and stamped with a generation counter, so
+    a new search never reinitializes them. Cells are converted back to `Vec2d` only when the path is rebuilt.
+    """
+
+    def __init__(self, logical_map):
+        """
+        :type logical_map LogicalMap
+        """
+        self.width = logical_map.width
+        self.cell_count = logical_map.width * logical_map.height
+        self.refresh(logical_map)
+        self.mask_steps = [tuple((dr * self.width + dc, cost) for dr, dc, cost in moves) for moves in MASK_MOVES]
+        self.g_score = array('d', bytes(8 * self.cell_count))
+        self.parent = array('q', bytes(8 * self.cell_count))
+        self.generation = array('q', bytes(8 * self.cell_count))  # Search in which the cell was last reached.
+        self.current_generation = 0
+
+    def refresh(self, logical_map):
+        """
+        Read the tiles of the map again, after they changed. The search arrays are kept.
+        """
+        if logical_map.move_masks is None:
+            logical_map.precompute_moves()
+        self.map_version = logical_map.version
+        self.masks = logical_map.move_masks.tobytes()
+
+    def cell(self, tile):
+        return tile[0] * self.width + tile[1]
+
+    def tile(self, cell):
+        return Vec2d(cell // self.width, cell % self.width)
+
+    def octile(self, cell, goal):
+        """
+        :return: The octile distance between two cells.
+        """
+        dr = abs(cell // self.width - goal // self.width)
+        dc = abs(cell % self.width - goal % self.width)
+        return dr + dc + (SQRT2 - 2) * min(dr, dc)
+
+    def search(self, start, goal, heuristic=None, config=None):
+        """ Performs A* between two tiles.
+
+        PARAMS and return values are the same of `astar`, except for `heuristic`: it is called with (row, column)
+        tuples and, if None, the octile distance is used on the cell ids directly. The profile also reports the
+        number of `generated` nodes.
+        """
+        config = {} if config is None else config
+        path_only = config['path_only'] if 'path_only' in config else False
+        profile = config['profile'] if 'profile' in config else False
+
+        profile_data = {'expanded': 0, 'generated': 0}
+
+        start_cell, goal_cell = self.cell(start), self.cell(goal)
+        if start_cell == goal_cell:
+            return return_path(path_only, profile, profile_data, [Vec2d(start[0], start[1])])
+
+        width = self.width
+        if heuristic is None:
+            h = lambda x: self.octile(x, goal_cell)
+        else:
+            goal_tile = (goal[0], goal[1])
+            h = lambda x: heuristic((x // width, x % width), goal_tile)
+
+        self.current_generation += 1
+        generation, current_generation = self.generation, self.current_generation
+        g_score, parent, masks, mask_steps = self.g_score, self.parent, self.masks, self.mask_steps
+
+        generation[start_cell] = current_generation
+        g_score[start_cell] = 0.0
+        parent[start_cell] = -1
+        openlist = [(h(start_cell), 0.0, start_cell)]
+        expanded = generated = 0
+        while openlist:
+            current_f, current_g, current = heappop(openlist)
+            if current_g > g_score[current]:
+                continue  # Stale entry: the cell was reached again with a lower g.
+
+            if current == goal_cell:
+                profile_data['expanded'], profile_data['generated'] = expanded, generated
+                path = []
+                while current != -1:
+                    path.append(self.tile(current))
+                    current = parent[current]
+                return return_path(path_only, profile, profile_data, list(reversed(path)), current_g)
+
+            expanded += 1
+            for step, cost in mask_steps[masks[current]]:
+                a = current + step
+                adjg = current_g + cost
+                if generation[a] != current_generation or adjg < g_score[a]:
+                    generation[a] = current_generation
+                    g_score[a] = adjg
+                    parent[a] = current
+                    generated += 1
+                    heappush(openlist, (adjg + h(a), adjg, a))
+
+        profile_data['expanded'], profile_data['generated'] = expanded, generated
+        return return_path(path_only, profile, profile_data, [])
+
+
+# One GridAstar per LogicalMap, kept alive as long as the map.
+_grid_searches = weakref.WeakKeyDictionary()
+
+
+def astar_grid(logical_map, start, goal, heuristic=None, config=None):
+    """ Performs A* over a LogicalMap with a `GridAstar` bound to the map. The search arrays are created by the
+    first call on a map and then reused until the map changes.
+
+    PARAMS and return values are the same of `GridAstar.search`.
+    """
+    searcher = _grid_searches.get(logical_map)
+    if searcher is None:
+        searcher = _grid_searches[logical_map] = GridAstar(logical_map)
+    elif searcher.map_version != logical_map.version:
+        searcher.refresh(logical_map)
+    return searcher.search(start, goal, heuristic, config)
+
+
+class JumpPointSearch(object):
+    """ Jump Point Search over a LogicalMap.
+
+    Diagonal moves follow the no-corner-cutting rule of `LogicalMap.cost`, so the pruning and jumping rules are
+    the ones of JPS for grids where a diagonal move needs both the orthogonal tiles traversable: straight jumps
+    stop next to the end of a wall running along them, diagonal jumps stop where a straight jump finds a jump
+    point. Paths are optimal and, once rebuilt, go through every tile like the ones of `astar`.
+
+    Cells are flat ids of the grid padded with a blocked border, so the jumps never test bounds. Search arrays
+    are reused across searches as in `GridAstar`.
+    """
+
+    def __init__(self, logical_map):
+        """
+        :type logical_map LogicalMap
+        """
+        self.stride = logical_map.width + 2
+        self.refresh(logical_map)
+        cell_count = len(self.passable)
+        self.g_score = array('d', bytes(8 * cell_count))
+        self.parent = array('q', bytes(8 * cell_count))
+        self.generation = array('q', bytes(8 * cell_count))
+        self.current_generation = 0
+
+    def refresh(self, logical_map):
+        """
+        Read the tiles of the map again, after they changed. The search arrays are kept.
+        """
+        self.map_version = logical_map.version
+        padded = np.zeros((logical_map.height + 2, self.stride), dtype=np.uint8)
+        padded[1:-1, 1:-1] = logical_map.passable
+        self.passable = padded.tobytes()
+
+    def cell(self, tile):
+        return (tile[0] + 1) * self.stride + tile[1] + 1
+
+    def tile(self, cell):
+        return Vec2d(cell // self.stride - 1, cell % self.stride - 1)
+
+    def octile(self, cell, goal):
+        dr = abs(cell // self.stride - goal // self.stride)
+        dc = abs(cell % self.stride - goal % self.stride)
+        return dr + dc + (SQRT2 - 2) * min(dr, dc)
+
+    def _direction(self, cell, parent):
+        dr = cell // self.stride - parent // self.stride
+        dc = cell % self.stride - parent % self.stride
+        return (dr > 0) - (dr < 0), (dc > 0) - (dc < 0)
+
+    def _successor_directions(self, cell, parent):
+        """
+        :return: The directions to jump toward from `cell`, reached from `parent` (-1 for the start).
+        """
+        passable, stride = self.passable, self.stride
+        if parent == -1:
+            return [(dr, dc) for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)) if passable[cell + dr * stride + dc]] + \
+                   [(dr, dc) for dr, dc in ((-1, -1), (-1, 1), (1, -1), (1, 1))
+                    if passable[cell + dr * stride] and passable[cell + dc] and passable[cell + dr * stride + dc]]
+        dr, dc = self._direction(cell, parent)
+        directions = []
+        if dr and dc:
+            vertical, horizontal = passable[cell + dr * stride], passable[cell + dc]
+            if vertical:
+                directions.append((dr, 0))
+            if horizontal:
+                directions.append((0, dc))
+            if vertical and horizontal and passable[cell + dr * stride + dc]:
+                directions.append((dr, dc))
+        elif dr:
+            left, right = passable[cell - 1], passable[cell + 1]
+            if passable[cell + dr * stride]:
+                directions.append((dr, 0))
+                if left and passable[cell + dr * stride - 1]:
+                    directions.append((dr, -1))
+                if right and passable[cell + dr * stride + 1]:
+                    directions.append((dr, 1))
+            if left:
+                directions.append((0, -1))
+            if right:
+                directions.append((0, 1))
+        else:
+            up, down = passable[cell - stride], passable[cell + stride]
+            if passable[cell + dc]:
+                directions.append((0, dc))
+                if up and passable[cell - stride + dc]:
+                    directions.append((-1, dc))
+                if down and passable[cell + stride + dc]:
+                    directions.append((1, dc))
+            if up:
+                directions.append((-1, 0))
+            if down:
+                directions.append((1, 0))
+        return directions
+
+    def _jump_straight(self, cell, dr, dc, goal):
+        passable, stride = self.passable, self.stride
+        if dr:
+            step = dr * stride
+            side_a, side_b = -1, 1
+        else:
+            step = dc
+            side_a, side_b = -stride, stride
+        n = cell + step
+        while passable[n]:
+            if n == goal:
+                return n
+            # A wall beside the previous tile ends here: the tile beside this one must be reached from here.
+            if (passable[n + side_a] and not passable[n + side_a - step]) or \
+                    (passable[n + side_b] and not passable[n + side_b - step]):
+                return n
+            n += step
+        return -1
+
+    def _jump(self, cell, dr, dc, goal):
+        """
+        :return: The first jump point from `cell` in the given direction, or -1.
+        """
+        if not (dr and dc):
+            return self._jump_straight(cell, dr, dc, goal)
+        passable, stride = self.passable, self.stride
+        n = cell + dr * stride + dc
+        while passable[n]:
+            if n == goal:
+                return n
+            if self._jump_straight(n, dr, 0, goal) != -1 or self._jump_straight(n, 0, dc, goal) != -1:
+                return n
+            if not (passable[n + dr * stride] and passable[n + dc]):
+                return -1
+            n += dr * stride + dc
+        return -1
+
+    def search(self, start, goal, heuristic=None, config=None):
+        """ Performs JPS between two tiles.
+
+        PARAMS and return values are the same of `GridAstar.search`. The profile reports the `expanded` and
+        `generated` jump points.
+        """
+        config = {} if config is None else config
+        path_only = config['path_only'] if 'path_only' in config else False
+        profile = config['profile'] if 'profile' in config else False
+
+        profile_data = {'expanded': 0, 'generated': 0}
+
+        start_cell, goal_cell = self.cell(start), self.cell(goal)
+        if start_cell == goal_cell:
+            return return_path(path_only, profile, profile_data, [Vec2d(start[0], start[1])])
+        if not self.passable[start_cell]:
+            return return_path(path_only, profile, profile_data, [])
+
+        stride = self.stride
+        if heuristic is None:
+            h = lambda x: self.octile(x, goal_cell)
+        else:
+            goal_tile = (goal[0], goal[1])
+            h = lambda x: heuristic((x // stride - 1, x % stride - 1), goal_tile)
+
+        self.current_generation += 1
+        generation, current_generation = self.generation, self.current_generation
+        g_score, parent = self.g_score, self.parent
+
+        generation[start_cell] = current_generation
+        g_score[start_cell] = 0.0
+        parent[start_cell] = -1
+        openlist = [(h(start_cell), 0.0, start_cell)]
+        expanded = generated = 0
+        while openlist:
+            current_f, current_g, current = heappop(openlist)
+            if current_g > g_score[current]:
+                continue
+
+            if current == goal_cell:
+                profile_data['expanded'], profile_data['generated'] = expanded, generated
+                return return_path(path_only, profile, profile_data, self._reconstruct(current), current_g)
+
+            expanded += 1
+            for dr, dc in self._successor_directions(current, parent[current]):
+                a = self._jump(current, dr, dc, goal_cell)
+                if a == -1:
+                    continue
+                adjg = current_g + self.octile(current, a)
+                if generation[a] != current_generation or adjg < g_score[a]:
+                    generation[a] = current_generation
+                    g_score[a] = adjg
+                    parent[a] = current
+                    generated += 1
+                    heappush(openlist, (adjg + h(a), adjg, a))
+
+        profile_data['expanded'], profile_data['generated'] = expanded, generated
+        return return_path(path_only, profile, profile_data, [])
+
+    def _reconstruct(self, cell):
+        """
+        Follow the parent links from a jump point back to the start, filling the tiles between jump points.
+        """
+        cells = [cell]
+        while self.parent[cell] != -1:
+            previous = self.parent[cell]
+            dr, dc = self._direction(previous, cell)
+            step = dr * self.stride + dc
+            while cell != previous:
+                cell += step
+                cells.append(cell)
+        return [self.tile(x) for x in reversed(cells)]
+
+
+_jump_point_searches = weakref.WeakKeyDictionary()
+
+
+def astar_jps(logical_map, start, goal, heuristic=None, config=None):
+    """ Performs JPS over a LogicalMap with a `JumpPointSearch` bound to the map, like `astar_grid`.
+
+    PARAMS and return values are the same of `GridAstar.search`.
+    """
+    searcher = _jump_point_searches.get(logical_map)
+    if searcher is None:
+        searcher = _jump_point_searches[logical_map] = JumpPointSearch(logical_map)
+    elif searcher.map_version != logical_map.version:
+        searcher.refresh(logical_map)
+    return searcher.search(start, goal, heuristic, config)
+
+
+# The engines that `astar` can delegate to on a LogicalMap.
+GRID_ENGINES = {'grid': astar_grid, 'jps': astar_jps}
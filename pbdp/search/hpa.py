@@ -2,41 +2,258 @@
 Implement Hierarchical Pathfinding over a map abstraction.
 """
 
-from pbdp.search.astar import astar
-from pbdp.model.hierarchical_map import ExtendedAbstraction, HierarchicalMap
+from collections import OrderedDict
+
+import numpy as np
+
+from pbdp.search.astar import astar, astar_indexed
+from pbdp.bdpcollections.frozen_graph import ExtendedFrozenGraph
+from pbdp.model.hierarchical_map import ExtendedAbstraction, HierarchicalMap, MultiLevelMap
 from pbdp.model.vector2d import Vec2d
 
 
-def hpa(searchable, start, goal, heuristic):
+class RefinementCache(object):
+    """
+    LRU cache of the low-level segments refined by `hpa` between two abstraction nodes (entrances).
+
+    Segments are stored once per pair of nodes, as arrays of (row, column) pairs, and returned reversed when
+    asked in the other direction. Segments depend only on the tiles, so the cache is bound to the entrances of
+    one abstraction (`structure_version`) and to the version of its map: it empties itself when it is used with a
+    different abstraction, or after the entrances or the tiles changed. Edge cost updates (e.g., `close_edge`) and
+    `cost_view` copies keep it. When the stored segments exceed
+    `max_bytes`, the least recently used ones are evicted.
     """
 
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    ENTRY_BYTES = 256  # Rough size of the bookkeeping of an entry, on top of its array.
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._segments = OrderedDict()  # (first, second) -> (segment array from first to second, cost)
+
+    def __len__(self):
+        return len(self._segments)
+
+    def clear(self):
+        self._segments.clear()
+        self.bytes = 0
+
+    def _check_version(self, map_abstraction):
+        version = (map_abstraction.structure_version, map_abstraction.original_map.version)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    @staticmethod
+    def _key(first, second):
+        first, second = tuple(first), tuple(second)
+        return ((first, second), False) if first <= second else ((second, first), True)
+
+    def get(self, map_abstraction, first, second):
+        """
+        :return: The (path, cost) pair of the segment from `first` to `second`, or None if it is not cached.
+        """
+        self._check_version(map_abstraction)
+        key, reverse = self._key(first, second)
+        entry = self._segments.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._segments.move_to_end(key)
+        self.hits += 1
+        segment, cost = entry
+        if reverse:
+            segment = segment[::-1]
+        return [Vec2d(r, c) for r, c in segment.tolist()], cost
+
+    def put(self, map_abstraction, first, second, path, cost):
+        """
+        Store the segment `path`, of cost `cost`, from `first` to `second`.
+        """
+        self._check_version(map_abstraction)
+        key, reverse = self._key(first, second)
+        segment = np.array([(x[0], x[1]) for x in path], dtype=np.int32).reshape(-1, 2)
+        if reverse:
+            segment = segment[::-1].copy()
+        size = segment.nbytes + self.ENTRY_BYTES
+        if size > self.max_bytes:
+            return
+        if key in self._segments:
+            self.bytes -= self._segments.pop(key)[0].nbytes + self.ENTRY_BYTES
+        while self._segments and self.bytes + size > self.max_bytes:
+            self.bytes -= self._segments.popitem(last=False)[1][0].nbytes + self.ENTRY_BYTES
+        self._segments[key] = (segment, cost)
+        self.bytes += size
+
+
+def hpa(searchable, start, goal, heuristic, engine='grid', cache=None):
+    """
+    Sub-paths are refined on the original map with the given search engine: 'grid' (`astar_grid`) and 'jps'
+    (`astar_jps`) use the octile distance, 'astar' (`astar`) uses `heuristic`.
+
     :param searchable:
     :type searchable HierarchicalMap
     :param start:
     :param goal:
     :param heuristic:
+    :param engine: The low-level search engine.
+    :param cache: An optional RefinementCache for the segments between abstraction nodes.
     :return:
     """
-    high_level, cost, profile_data = hpa_high_level(searchable, start, goal, heuristic)
+    profile_data = {}
+    path = []
+    for segment in _refined_segments(searchable, start, goal, heuristic, engine, cache, profile_data):
+        path += segment
+    return path, profile_data
 
-    profile_data = {'high-level expanded': profile_data['expanded'], 'expanded': 0}
 
-    def merge_sub_path(accumulator, first, second):
-        lpath, cost, profile = astar(searchable.original_map, Vec2d(first), Vec2d(second), heuristic, {'profile': True})
-        profile_data['expanded'] += profile['expanded']
-        return accumulator + lpath
+def hpa_steps(searchable, start, goal, heuristic, engine='grid', cache=None, profile_data=None):
+    """
+    Generator version of `hpa`. The high-level path is searched when the first step is requested, but every
+    low-level segment is refined only when the consumer reaches it. Every tile of the path is yielded once.
+    The generator stops early if a segment can not be refined.
 
-    path = []
-    i = 0
-    while i < len(high_level)-1:
-        path = merge_sub_path(path, high_level[i], high_level[i+1])
-        i += 1
+    :param profile_data: An optional dictionary, updated with the profile of `hpa` as the refinement goes on.
+    """
+    profile_data = {} if profile_data is None else profile_data
+    first = True
+    for segment in _refined_segments(searchable, start, goal, heuristic, engine, cache, profile_data):
+        if not segment:
+            return
+        for tile in (segment if first else segment[1:]):
+            yield tile
+        first = False
 
-    print(path)
-    return path, profile_data
 
+def _refined_segments(searchable, start, goal, heuristic, engine, cache, profile_data):
+    """
+    Find the high-level path and yield, one at a time, the low-level paths between its consecutive nodes.
+    """
+    high_level, cost, high_level_profile = hpa_high_level(searchable, start, goal, heuristic)
+
+    profile_data.update({'high-level expanded': high_level_profile['expanded'], 'expanded': 0, 'generated': 0,
+                         'cache hits': 0})
 
-def hpa_high_level(searchable, start, goal, heuristic):
+    for first, second in zip(high_level, high_level[1:]):
+        cacheable = cache is not None and searchable.is_node(first) and searchable.is_node(second)
+        cached = cache.get(searchable, first, second) if cacheable else None
+        if cached is not None:
+            profile_data['cache hits'] += 1
+            yield cached[0]
+            continue
+        if engine == 'astar':
+            lpath, cost, profile = astar(searchable.original_map, Vec2d(first), Vec2d(second), heuristic,
+                                         {'profile': True})
+        else:
+            lpath, cost, profile = astar(searchable.original_map, first, second, None,
+                                         {'profile': True, 'engine': engine})
+        profile_data['expanded'] += profile['expanded']
+        profile_data['generated'] += profile.get('generated', 0)
+        if cacheable:
+            cache.put(searchable, first, second, lpath, cost)
+        yield lpath
+
+
+def hpa_high_level(searchable, start, goal, heuristic, edge_costs=None, expansions=None, clusters=None):
+    """
+
+    :param searchable:
+    :type searchable HierarchicalMap
+    :param start:
+    :param goal:
+    :param heuristic:
+    :param edge_costs: Optional array of edge costs, indexed by edge id, overriding the costs of a frozen
+                       abstraction.
+    :param expansions: Optional list. On frozen abstractions, the search appends to it the (node id, g) pair
+                       of every expanded node of the FrozenGraph.
+    :param clusters: Optional list of clusters of a frozen abstraction. The search only visits the entrances
+                     in them.
+    :return:
+    """
+    restricted = edge_costs is not None or expansions is not None or clusters is not None
+    if isinstance(searchable, MultiLevelMap):
+        if restricted:
+            raise ValueError("Edge costs, ids and clusters are available only on frozen abstractions.")
+        return _multilevel_high_level(searchable, start, goal, heuristic)
+    if searchable.is_frozen:
+        return _frozen_high_level(searchable, start, goal, heuristic, edge_costs, expansions, clusters)
+    if restricted:
+        raise ValueError("Edge costs, ids and clusters are available only on frozen abstractions.")
     extended = ExtendedAbstraction(searchable, start, goal)
     high_level_pack = astar(extended, start, goal, heuristic, config={'profile': True})
     return high_level_pack
+
+
+def _frozen_high_level(searchable, start, goal, heuristic, edge_costs=None, expansions=None, clusters=None):
+    """
+    High-level search over a frozen abstraction. It runs `astar_indexed` on the integer ids of the
+    FrozenGraph and translates the resulting path back to nodes.
+    """
+    allowed = None
+    if clusters is not None:
+        node_ids = searchable.abstraction_graph.node_ids
+        nodes = [x for cluster in clusters for x in searchable.get_all_in_cluster(cluster)] + [start, goal]
+        allowed = set(node_ids[x] for x in nodes if x in node_ids)
+    extended = ExtendedFrozenGraph(searchable.abstraction_graph, edge_costs, allowed)
+    for node in (start, goal):
+        extended.add_extended_node(node, *searchable.cell_connections(node))
+    ids_heuristic = lambda a, b: heuristic(extended.node(a), extended.node(b))
+    config = {'profile': True}
+    if expansions is not None:
+        config['expansions'] = []
+    path, cost, profile_data = astar_indexed(extended, extended.node_id(start), extended.node_id(goal),
+                                             ids_heuristic, config=config)
+    if expansions is not None:
+        base_count = searchable.abstraction_graph.node_count
+        expansions.extend(x for x in config['expansions'] if x[0] < base_count)
+    return [extended.node(x) for x in path], cost, profile_data
+
+
+def _multilevel_high_level(searchable, start, goal, heuristic):
+    """
+    High-level search over a MultiLevelMap. The path is searched on the highest level where start and goal are
+    in different clusters (going down if that level does not connect them), then every step of it is refined on
+    the level below, down to the first level. A refinement only visits the clusters of the lower level inside
+    the clusters of the two ends of the step, so its cost does not grow with the map. The result is a path of
+    the first level, as for a HierarchicalMap. The profile reports the nodes expanded on every level.
+    """
+    levels = searchable.levels
+    profile_data = {'expanded': 0, 'level expanded': [0] * len(levels)}
+    top = len(levels) - 1
+    while top > 0 and levels[top].get_tile_cluster(start) == levels[top].get_tile_cluster(goal):
+        top -= 1
+    path = []
+    while top >= 0 and not path:
+        path, cost, level_profile = hpa_high_level(levels[top].frozen_view(), start, goal, heuristic)
+        profile_data['level expanded'][top] += level_profile['expanded']
+        top -= 1
+    for level in range(top, -1, -1):
+        lower, upper = levels[level].frozen_view(), levels[level + 1]
+        refined, cost = [path[0]], 0
+        for first, second in zip(path, path[1:]):
+            clusters = _inner_clusters(lower, upper, set(upper.get_tile_cluster(x) for x in (first, second)))
+            segment, segment_cost, level_profile = hpa_high_level(lower, first, second, heuristic,
+                                                                  clusters=clusters)
+            profile_data['level expanded'][level] += level_profile['expanded']
+            if not segment:
+                profile_data['expanded'] = sum(profile_data['level expanded'])
+                return [], float('inf'), profile_data
+            refined.extend(segment[1:])
+            cost += segment_cost
+        path = refined
+    profile_data['expanded'] = sum(profile_data['level expanded'])
+    return path, cost, profile_data
+
+
+def _inner_clusters(lower, upper, upper_clusters):
+    """
+    :return: The list of the clusters of the level `lower` inside the given clusters of the level `upper`.
+    """
+    ratio = upper.cluster_size // lower.cluster_size
+    return [(i, j) for row, col in upper_clusters
+            for i in range(row * ratio, min((row + 1) * ratio, lower.cluster_height))
+            for j in range(col * ratio, min((col + 1) * ratio, lower.cluster_width))]
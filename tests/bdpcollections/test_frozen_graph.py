@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from pbdp.bdpcollections.graph import Graph
+from pbdp.bdpcollections.frozen_graph import FrozenGraph, ExtendedFrozenGraph
+
+
+class TestFrozenGraph(TestCase):
+
+    def setUp(self):
+        graph = Graph()
+        graph.add_edge(1, 2, {"type": "inter", "cost": 1})
+        graph.add_edge(2, 3, {"type": "intra", "cost": 2.5})
+        graph.add_edge(3, 1, {"type": "intra", "cost": 4})
+        graph.add_edge(3, 4, {"type": "inter", "cost": 1})
+        self.graph = FrozenGraph(graph)
+
+    def test_structure(self):
+        self.assertEqual(4, self.graph.node_count)
+        self.assertEqual(4, self.graph.edge_count)
+        self.assertEqual({2, 3}, set(self.graph.neighbours(1)))
+        self.assertEqual({1, 2, 4}, set(self.graph.neighbours(3)))
+        self.assertIn(4, self.graph)
+        self.assertNotIn(5, self.graph)
+        self.assertEqual(8, len(list(self.graph.edges)))
+
+    def test_edge_labels(self):
+        self.assertEqual({"type": "intra", "cost": 2.5}, self.graph.get_edge_label((3, 2)))
+        self.assertTrue(self.graph.is_adjacent(4, 3))
+        self.assertFalse(self.graph.is_adjacent(1, 4))
+        self.assertIsNone(self.graph.get_edge_label((1, 4)))
+        self.assertEqual((3, 1), self.graph.canonical_edge((1, 3)))
+
+    def test_update_edge_label(self):
+        self.graph.update_edge_label((2, 1), {"type": "inter", "cost": float('inf')})
+        self.assertEqual(float('inf'), self.graph.get_edge_label((1, 2))["cost"])
+        self.assertEqual(2, len(self.graph.edge_ids_of_type('inter')))
+        self.assertRaises(TypeError, self.graph.add_edge, 1, 4)
+
+    def test_extension(self):
+        extended = ExtendedFrozenGraph(self.graph)
+        start = extended.add_extended_node("S", [1, 2], [3, 5])
+        self.assertEqual(4, start)
+        self.assertEqual("S", extended.node(start))
+        self.assertEqual(start, extended.node_id("S"))
+        self.assertIn((start, 3), extended.successors(self.graph.node_ids[1]))
+        self.assertEqual({(self.graph.node_ids[1], 3), (self.graph.node_ids[2], 5)}, set(extended.successors(start)))
@@ -41,6 +41,55 @@ class TestGraph(TestCase):
         self.assertEqual({2}, graph.neighbours(1))
         self.assertEqual({1, 3, 4}, graph.neighbours(2))
 
+    def test_is_adjacent(self):
+        graph = Graph()
+        graph.add_edge(1, 2)
+        graph.add_edge(2, 3)
+        self.assertTrue(graph.is_adjacent(1, 2))
+        self.assertTrue(graph.is_adjacent(2, 1))
+        self.assertFalse(graph.is_adjacent(1, 3))
+        self.assertFalse(graph.is_adjacent(1, 7))
+
+    def test_remove(self):
+        graph = Graph()
+        graph.add_edge(1, 2, "First")
+        graph.add_edge(2, 3, "Second")
+        graph.add_edge(3, 1, "Third")
+        graph.remove_edge(2, 1)
+        self.assertFalse(graph.is_adjacent(1, 2))
+        self.assertIsNone(graph.get_edge_label((1, 2)))
+        self.assertIn(1, graph)
+        graph.remove_node(3)
+        self.assertNotIn(3, graph)
+        self.assertEqual([], list(graph.canonical_edges))
+        self.assertEqual(set(), graph.neighbours(2))
+        graph.remove_edge(1, 7)
+
+    def test_cost_overlay(self):
+        graph = Graph()
+        graph.add_edge(1, 2, "Original")
+        graph.add_edge(2, 3, "Untouched")
+        overlay = graph.cost_overlay()
+        overlay.update_edge_label((2, 1), "Overridden")
+        self.assertEqual("Overridden", overlay.get_edge_label((1, 2)))
+        self.assertEqual("Untouched", overlay.get_edge_label((3, 2)))
+        self.assertEqual("Original", graph.get_edge_label((1, 2)))
+        self.assertEqual({(1, 2): "Overridden"}, overlay.overridden_labels)
+        self.assertEqual({1, 3}, overlay.neighbours(2))
+
+    def test_canonical_edges(self):
+        graph = Graph()
+        graph.add_edge(1, 2, "First")
+        graph.add_edge(2, 1, "Second")
+        graph.add_edge(2, 3)
+        self.assertEqual((1, 2), graph.canonical_edge((2, 1)))
+        self.assertEqual({(1, 2), (2, 3)}, set(graph.canonical_edges))
+        self.assertEqual({(1, 2): "Second"}, graph.edge_labels)
+        graph.update_edge_label((3, 2), "Third")
+        self.assertEqual("Third", graph.get_edge_label((2, 3)))
+        self.assertEqual("Second", graph.get_edge_label((2, 1)))
+        self.assertIsNone(graph.get_edge_label((1, 3)))
+
 
 class TestExtensionGraph(TestCase):
 
@@ -81,4 +130,18 @@ class TestExtensionGraph(TestCase):
     def test_is_adjacent(self):
         self.assertTrue(self.test_graph.is_adjacent("A", 2))
         self.assertTrue(self.test_graph.is_adjacent("B", 4))
+        self.assertTrue(self.test_graph.is_adjacent(4, "B"))
+        self.assertTrue(self.test_graph.is_adjacent(1, 2))
+        self.assertFalse(self.test_graph.is_adjacent("A", 3))
+        self.assertFalse(self.test_graph.is_adjacent("A", "B"))
+
+    def test_boundary_vertices(self):
+        self.assertSetEqual({1, 2, 3, 4}, self.test_graph.boundary_vertices)
+        self.test_graph.add_extended_node("A", [5], ["Moved"])
+        self.assertSetEqual({3, 4, 5}, self.test_graph.boundary_vertices)
+        self.assertSetEqual({1, 2, 3, 4, "A"}, set(self.test_graph.neighbours(5)))
+        self.assertIsNone(self.test_graph.get_edge_label(("A", 1)))
+
+    def test_edges(self):
+        self.assertEqual(16 + 8, len(list(self.test_graph.edges)))
 
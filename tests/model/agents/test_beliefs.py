@@ -3,6 +3,8 @@ from unittest import TestCase
 __author__ = 'davide'
 
 from pbdp.model.agents.beliefs import AgentBeliefsModel
+from pbdp.model.hierarchical_map import HierarchicalMap
+from pbdp.model.map import LogicalMap
 
 class TestAgentBeliefModel(TestCase):
 
@@ -42,3 +44,62 @@ class TestAgentBeliefModel(TestCase):
         self.assertEqual(beliefs[1,2],0.5)
         self.assertLess(beliefs[3,3],0.9)
         self.assertGreater(beliefs[2,2],0.3)
+
+    def test_undirected(self):
+        beliefs = AgentBeliefsModel()
+        beliefs.update((1,2),0.3)
+        self.assertIn((2,1),beliefs)
+        self.assertEqual(beliefs[2,1],0.3)
+        self.assertNotIn((1,3),beliefs)
+
+    def test_copy_on_write(self):
+        beliefs = AgentBeliefsModel()
+        beliefs.update((1,2),0.2)
+        cloned = beliefs.clone()
+        cloned.update((1,2),0.9)
+        cloned.update((3,4),0.1)
+        self.assertEqual(beliefs[1,2],0.2)
+        self.assertNotIn((3,4),beliefs)
+        beliefs.decay()
+        self.assertEqual(cloned[1,2],0.9)
+
+    def test_initialize(self):
+        abstraction = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        abstraction.generate_abstract_graph()
+        beliefs = AgentBeliefsModel()
+        beliefs.initialize(abstraction, 0.7)
+        graph = abstraction.frozen_view().abstraction_graph
+        values, present = beliefs.edge_values(graph)
+        self.assertEqual(set(graph.edge_ids_of_type('inter')), set(present.nonzero()[0]))
+        for edge in abstraction.inter_edges:
+            self.assertEqual(beliefs[edge],0.7)
+            self.assertEqual(beliefs[edge[1],edge[0]],0.7)
+        self.assertNotIn(((9,5),(5,9)),beliefs)  # An intra edge.
+
+    def test_initialize_clone(self):
+        abstraction = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        abstraction.generate_abstract_graph()
+        beliefs = AgentBeliefsModel()
+        cloned = beliefs.clone()
+        cloned.initialize(abstraction, 0.7)
+        for edge in abstraction.inter_edges:
+            self.assertNotIn(edge,beliefs)
+            beliefs.update(edge,0.4)
+            self.assertEqual(beliefs[edge],0.4)
+            self.assertEqual(cloned[edge],0.7)
+
+    def test_lazy_decay(self):
+        eager = AgentBeliefsModel()
+        lazy = AgentBeliefsModel(lazy_decay=True)
+        for beliefs in (eager, lazy):
+            beliefs.update((1,2),0.9)
+            beliefs.update((2,3),0.1)
+            beliefs.decay()
+            beliefs.decay()
+            beliefs.update((2,3),0.0)
+            beliefs.decay()
+        cloned = lazy.decayed()
+        eager.decay()
+        for edge in ((1,2),(2,3)):
+            self.assertAlmostEqual(eager[edge],cloned[edge])
+        self.assertNotAlmostEqual(lazy[1,2],cloned[1,2])
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pbdp.model.abstraction_cache import AbstractionCache
+from pbdp.model.hierarchical_map import HierarchicalMap
+from pbdp.model.map import LogicalMap
+
+__author__ = 'davide'
+
+
+class TestAbstractionCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = AbstractionCache(os.path.join(self.directory, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def labels(self, abstraction):
+        graph = abstraction.abstraction_graph
+        return dict((edge, graph.get_edge_label(edge)) for edge in graph.canonical_edges)
+
+    def test_save_load(self):
+        abstraction = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        abstraction.generate_abstract_graph()
+        abstraction.close_edge(((9, 5), (5, 9)))
+        path = os.path.join(self.directory, "arena.npz")
+        abstraction.save(path)
+        loaded = HierarchicalMap.load(abstraction.original_map, path)
+        self.assertEqual(abstraction.cluster_size, loaded.cluster_size)
+        self.assertEqual(abstraction.vertical_entrances, loaded.vertical_entrances)
+        self.assertEqual(abstraction.horizontal_entrances, loaded.horizontal_entrances)
+        self.assertEqual(abstraction.get_all_in_cluster((0, 0)), loaded.get_all_in_cluster((0, 0)))
+        self.assertEqual(self.labels(abstraction), self.labels(loaded))
+        self.assertFalse(loaded.is_traversable((5, 9), (9, 5)))
+
+    def test_get(self):
+        built = self.cache.get("./maps/arena.map", 0.2)
+        path = self.cache.path("./maps/arena.map", built.cluster_size)
+        self.assertTrue(os.path.exists(path))
+        modified = os.path.getmtime(path)
+        loaded = self.cache.get("./maps/arena.map", 0.2, built.original_map)
+        self.assertEqual(modified, os.path.getmtime(path))
+        self.assertEqual(self.labels(built), self.labels(loaded))
+        self.assertNotEqual(path, self.cache.path("./maps/arena.map", 5))
+
+    def test_file_hash(self):
+        path = os.path.join(self.directory, "copy.map")
+        shutil.copy("./maps/arena.map", path)
+        digest = self.cache.file_hash(path)
+        self.assertEqual(AbstractionCache.map_hash(path), digest)
+        with open(path, "a") as f:
+            f.write("\n")
+        self.assertNotEqual(digest, self.cache.file_hash(path))
+        self.assertEqual(AbstractionCache.map_hash(path), self.cache.file_hash(path))
+
+    def test_get_corrupted(self):
+        built = self.cache.get("./maps/arena.map", 0.2)
+        path = self.cache.path("./maps/arena.map", built.cluster_size)
+        with open(path, "wb") as f:
+            f.write(b"not an abstraction")
+        rebuilt = self.cache.get("./maps/arena.map", 0.2, built.original_map)
+        self.assertEqual(self.labels(built), self.labels(rebuilt))
+        self.assertEqual(self.labels(built), self.labels(HierarchicalMap.load(built.original_map, path)))
+        self.assertEqual(["{}".format(os.path.basename(path))], os.listdir(os.path.dirname(path)))
+
+    def test_bundle(self):
+        with self.cache.bundle("./maps/arena.map", 0.2) as bundle:
+            built = self.labels(bundle.abstraction())
+        path = self.cache.path("./maps/arena.map", 10, ".bundle")
+        modified = os.path.getmtime(path)
+        with self.cache.bundle("./maps/arena.map", 0.2) as bundle:
+            self.assertEqual(built, self.labels(bundle.abstraction()))
+        self.assertEqual(modified, os.path.getmtime(path))
+        with open(path, "r+b") as f:
+            f.truncate(1000)
+        with self.cache.bundle("./maps/arena.map", 0.2) as bundle:
+            self.assertEqual(built, self.labels(bundle.abstraction()))
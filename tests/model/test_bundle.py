@@ -0,0 +1,97 @@
+import itertools
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from pbdp.bdpcollections.frozen_graph import TileIndex
+from pbdp.model.bundle import MapBundle, compile_bundle, component_labels
+from pbdp.model.hierarchical_map import HierarchicalMap
+from pbdp.model.map import LogicalMap, distance_euclidean
+from pbdp.search.hpa import hpa_high_level
+
+__author__ = 'davide'
+
+
+class TestMapBundle(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.abstraction = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        self.abstraction.generate_abstract_graph()
+        self.path = os.path.join(self.directory, "arena.bundle")
+        compile_bundle(self.abstraction, self.path)
+        self.bundle = MapBundle(self.path)
+
+    def tearDown(self):
+        self.bundle.close()
+        shutil.rmtree(self.directory)
+
+    def test_logical_map(self):
+        logical_map = self.bundle.logical_map()
+        original = self.abstraction.original_map
+        self.assertTrue(np.array_equal(original.grid, logical_map.grid))
+        self.assertTrue(np.array_equal(original.passable, logical_map.passable))
+        self.assertFalse(logical_map.grid.flags.writeable)
+        self.assertEqual(original.cost((1, 1), (2, 2)), logical_map.cost((1, 1), (2, 2)))
+
+    def test_set_tile_copies(self):
+        logical_map = self.bundle.logical_map()
+        logical_map.set_tile((3, 3), '@')
+        self.assertFalse(logical_map.is_traversable((3, 3)))
+        self.assertTrue(self.bundle.passable[3, 3])
+
+    def test_abstraction(self):
+        abstraction = self.bundle.abstraction()
+        self.assertTrue(abstraction.is_frozen)
+        self.assertEqual(self.abstraction.vertical_entrances, list(abstraction.vertical_entrances))
+        self.assertEqual(self.abstraction.horizontal_entrances, list(abstraction.horizontal_entrances))
+        for cluster in itertools.product(range(-1, 6), repeat=2):
+            self.assertEqual(self.abstraction.get_all_in_cluster(cluster), abstraction.get_all_in_cluster(cluster))
+        graph, frozen = abstraction.abstraction_graph, self.abstraction.frozen_view().abstraction_graph
+        self.assertIsInstance(graph.node_ids, TileIndex)  # Read from the mapped arrays, not rebuilt.
+        self.assertEqual(list(frozen.edge_keys), list(graph.edge_keys))
+        self.assertEqual(frozen.neighbours((5, 9)), graph.neighbours((5, 9)))
+        self.assertNotIn((0, 0), graph)
+        start, end = (3, 3), (45, 45)
+        _, expected, _ = hpa_high_level(self.abstraction.frozen_view(), start, end, distance_euclidean)
+        _, cost, _ = hpa_high_level(abstraction, start, end, distance_euclidean)
+        self.assertAlmostEqual(expected, cost)
+        abstraction.close_edge(((9, 5), (5, 9)))
+        self.assertFalse(abstraction.is_traversable((9, 5), (5, 9)))
+        self.assertFalse(self.bundle.costs.flags.writeable)
+        self.assertTrue(self.bundle.abstraction().is_traversable((9, 5), (5, 9)))
+
+    def test_free_cells(self):
+        passable = self.abstraction.original_map.passable
+        self.assertEqual(np.count_nonzero(passable), len(self.bundle.free_cells))
+        rng = np.random.default_rng(0)
+        cells = set(self.bundle.random_free_cell(rng) for _ in range(20))
+        self.assertGreater(len(cells), 1)
+        for cell in cells:
+            self.assertTrue(passable[cell])
+
+    def test_components(self):
+        passable = np.ones((4, 6), dtype=bool)
+        passable[:, 2] = False
+        passable[0, 4] = passable[1, 3] = False  # (0, 3) is only diagonally connected to (1, 4).
+        labels = component_labels(passable)
+        self.assertEqual(0, labels[0, 2])
+        self.assertEqual(labels[0, 0], labels[3, 1])
+        self.assertNotEqual(labels[0, 0], labels[3, 5])
+        self.assertNotEqual(labels[0, 3], labels[1, 4])
+        self.assertEqual(3, labels.max())
+
+    def test_not_a_bundle(self):
+        path = os.path.join(self.directory, "other")
+        with open(path, "wb") as f:
+            f.write(b"0" * 64)
+        self.assertRaises(ValueError, MapBundle, path)
+
+    def test_close(self):
+        with MapBundle(self.path) as bundle:
+            self.assertEqual(self.bundle.free_cells.sum(), bundle.free_cells.sum())
+        self.assertRaises(AttributeError, getattr, bundle, "grid")
+        self.assertRaises(ValueError, bundle._mmap.read, 1)
@@ -20,4 +20,52 @@ class TestExtendedAbstraction(TestCase):
         self.assertEqual(self.abstraction.cost((5, 5), (5, 9)), 4)
 
     def test_is_traversable(self):
-        self.assertTrue(self.abstraction.is_traversable((40,44),(40,40)))
\ No newline at end of file
+        self.assertTrue(self.abstraction.is_traversable((40,44),(40,40)))
+
+    def test_true_costs(self):
+        logical_map = LogicalMap("./maps/arena.map")
+        for r in (6, 7, 8):
+            logical_map.set_tile((r, 7), '@')
+        base = HierarchicalMap(logical_map, 0.2)
+        base.generate_abstract_graph()
+        abstraction = ExtendedAbstraction(base, (7, 8), (40, 40))
+        self.assertAlmostEqual(abstraction.cost((7, 8), (5, 9)), 1 + 2 ** 0.5)
+        self.assertAlmostEqual(abstraction.cost((7, 8), (9, 5)), 5)  # Around the wall, not 3.6 across it.
+
+    def test_unreachable_entrances(self):
+        wall = [(r, 7) for r in range(1, 10)]
+        for r, c in wall:
+            self.base.original_map.set_tile((r, c), '@')
+        self.base.update_tiles(wall)
+        entrances = self.base.get_all_in_cluster((0, 0))
+        self.assertTrue(any(c < 7 for _, c in entrances))
+        connections, costs = self.base.cell_connections((5, 8))
+        self.assertTrue(connections)
+        self.assertEqual(sorted(x for x in entrances if x[1] > 7), sorted(connections))
+        abstraction = ExtendedAbstraction(self.base, (5, 8), (40, 40))
+        self.assertEqual(sorted(connections), sorted(abstraction.neighbours((5, 8))))
+
+    def test_connections_cache(self):
+        connections = self.base.cell_connections((5, 5))
+        self.assertIs(connections, self.base.cell_connections((5, 5)))
+        self.base.close_edge(((9, 5), (5, 9)))
+        self.assertIs(connections, self.base.cell_connections((5, 5)))
+        self.base.original_map.set_tile((7, 7), '@')
+        self.base.update_tiles([(7, 7)])
+        self.assertIsNot(connections, self.base.cell_connections((5, 5)))
+
+    def test_connections_eviction(self):
+        self.base.CONNECTION_CACHE_SIZE = 2
+        first, second = self.base.cell_connections((5, 5)), self.base.cell_connections((5, 6))
+        self.assertIs(first, self.base.cell_connections((5, 5)))
+        self.base.cell_connections((5, 7))  # Evicts (5, 6), the least recently used tile.
+        self.assertIs(first, self.base.cell_connections((5, 5)))
+        self.assertIsNot(second, self.base.cell_connections((5, 6)))
+
+    def test_connections_shared_with_views(self):
+        connections = self.base.cell_connections((5, 5))
+        for _ in range(3):  # Replans on a fresh view with closed edges.
+            view = self.base.cost_view()
+            view.close_edge(((9, 5), (5, 9)))
+            self.assertIs(connections, view.cell_connections((5, 5)))
+            self.assertIs(connections, view.frozen_view().cell_connections((5, 5)))
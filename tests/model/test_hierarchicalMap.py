@@ -1,17 +1,25 @@
 from unittest import TestCase, skipIf
 
+import itertools
 import os
+import shutil
+import tempfile
 
 __author__ = 'davide'
 
-from pbdp.model.map import LogicalMap
-from pbdp.model.hierarchical_map import HierarchicalMap, PlotMap
+from pbdp.model.map import LogicalMap, distance_euclidean
+from pbdp.search.hpa import hpa_high_level
+from pbdp.model.hierarchical_map import HierarchicalMap, MultiLevelMap, PlotMap
 
 
 class TestHierarchicalMap(TestCase):
     def setUp(self):
         self.abstraction = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
         self.abstraction.generate_abstract_graph()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
 
     def test_cluster_width(self):
         self.assertEqual(5, self.abstraction.cluster_width)
@@ -19,6 +27,11 @@ class TestHierarchicalMap(TestCase):
     def test_cluster_height(self):
         self.assertEqual(5, self.abstraction.cluster_height)
 
+    def test_cluster_size(self):
+        abstraction = HierarchicalMap(self.abstraction.original_map, cluster_size=7)
+        self.assertEqual(7, abstraction.cluster_size)
+        self.assertEqual(7, abstraction.cluster_width)
+
     def test_generate_abstract_graph(self):
         # TODO: Check only runtime error! No validity check!
         self.abstraction.generate_abstract_graph()
@@ -30,6 +43,77 @@ class TestHierarchicalMap(TestCase):
         self.assertEqual(4, len(entrances))
         self.assertEqual({(9, 5), (5, 9)}, set(entrances))
 
+    def test_intra_costs(self):
+        self.assertAlmostEqual(4 * 2**0.5, self.abstraction.abstraction_graph.get_edge_label(((9, 5), (5, 9)))["cost"])
+        for edge in self.abstraction.abstraction_graph.canonical_edges:
+            if self.abstraction.is_edge_type(edge, 'intra'):
+                cost = self.abstraction.abstraction_graph.get_edge_label(edge)["cost"]
+                self.assertGreaterEqual(cost + 1e-9, distance_euclidean(*edge))
+
+    def test_intra_costs_disconnected(self):
+        # The wall separates the right border of cluster (0, 0) from its bottom border.
+        rows = ["...T......"] * 3 + ["...TT.....", "....T....."] + ["." * 10] * 5
+        path = os.path.join(self.directory, "wall.map")
+        with open(path, "w") as f:
+            f.write("type octile\nheight 10\nwidth 10\nmap\n" + "\n".join(rows) + "\n")
+        abstraction = HierarchicalMap(LogicalMap(path), 0.5)
+        abstraction.generate_abstract_graph()
+        self.assertEqual({(1, 4), (4, 2)}, set(abstraction.get_all_in_cluster((0, 0))))
+        self.assertFalse(abstraction.abstraction_graph.is_adjacent((1, 4), (4, 2)))
+
+    def test_generate_abstract_graph_workers(self):
+        parallel = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        parallel.generate_abstract_graph(workers=2)
+        graph = self.abstraction.abstraction_graph
+        self.assertEqual(set(graph.canonical_edges), set(parallel.abstraction_graph.canonical_edges))
+        for edge in graph.canonical_edges:
+            self.assertEqual(graph.get_edge_label(edge), parallel.abstraction_graph.get_edge_label(edge))
+
+    def test_get_all_in_cluster_index(self):
+        self.abstraction.generate_abstract_graph()
+        for cluster in itertools.product(range(5), range(5)):
+            expected = []
+            for entrances in (self.abstraction.vertical_entrances, self.abstraction.horizontal_entrances):
+                for nodes, clusters in entrances:
+                    expected.extend(node for node, x in zip(nodes, clusters) if x == cluster)
+            self.assertEqual(expected, self.abstraction.get_all_in_cluster(cluster))
+
+    def test_update_tiles(self):
+        logical_map = self.abstraction.original_map
+        changes = dict(((r, 9), 'T') for r in range(3, 8))
+        changes.update(((25, c), 'T') for c in range(20, 29))
+        changes[(15, 16)] = '.'
+        for tile, value in changes.items():
+            logical_map.set_tile(tile, value)
+        version = self.abstraction.version
+        report = self.abstraction.update_tiles(changes.keys())
+        self.assertNotEqual(version, self.abstraction.version)
+        self.assertIn(((5, 9), (9, 5)), [tuple(sorted(edge)) for edge in report['removed']])
+        self.assertTrue(report['added'])
+        for edge in report['added'] + report['changed']:
+            self.assertTrue(self.abstraction.abstraction_graph.is_adjacent(*edge))
+        for edge in report['removed']:
+            self.assertFalse(self.abstraction.abstraction_graph.is_adjacent(*edge))
+
+        rebuilt = HierarchicalMap(logical_map, 0.2)
+        rebuilt.generate_abstract_graph()
+
+        def labels(graph):
+            return dict((tuple(sorted(edge)), graph.get_edge_label(edge)) for edge in graph.canonical_edges)
+        self.assertEqual(labels(rebuilt.abstraction_graph), labels(self.abstraction.abstraction_graph))
+        self.assertEqual(set(rebuilt.abstraction_graph.vertices), set(self.abstraction.abstraction_graph.vertices))
+        for cluster in itertools.product(range(5), range(5)):
+            self.assertEqual(set(rebuilt.get_all_in_cluster(cluster)), set(self.abstraction.get_all_in_cluster(cluster)))
+
+    def test_update_tiles_unchanged_costs(self):
+        # The wall at (34, 27) is off the shortest path of the intra edge, whose cost is computed again with a
+        # different rounding.
+        self.abstraction.original_map.set_tile((34, 27), 'T')
+        report = self.abstraction.update_tiles([(34, 27)])
+        self.assertNotIn(((30, 25), (35, 29)), [tuple(sorted(edge)) for edge in report['changed']])
+        self.assertAlmostEqual(1 + 4 * 2**0.5,
+                               self.abstraction.abstraction_graph.get_edge_label(((35, 29), (30, 25)))["cost"])
+
     def test_get_tile_cluster(self):
         self.assertEqual((0, 0), self.abstraction.get_tile_cluster((5, 5)))
 
@@ -43,6 +127,65 @@ class TestHierarchicalMap(TestCase):
         self.assertTrue(self.abstraction.is_node((9, 5)))
         self.assertFalse(self.abstraction.is_node((10, 24)))
 
+    def test_cost_view(self):
+        for abstraction in (self.abstraction, self.abstraction.freeze()):
+            view = abstraction.cost_view()
+            view.close_edge(((9, 5), (5, 9)))
+            self.assertFalse(view.is_traversable((5, 9), (9, 5)))
+            self.assertTrue(abstraction.is_traversable((9, 5), (5, 9)))
+            self.assertIs(abstraction.original_map, view.original_map)
+            self.assertRaises(TypeError, view.abstraction_graph.add_edge, (1, 1), (2, 2))
+
+    def test_frozen_view(self):
+        frozen = self.abstraction.frozen_view()
+        self.assertTrue(frozen.is_frozen)
+        self.assertFalse(self.abstraction.is_frozen)
+        self.assertIs(frozen, self.abstraction.frozen_view())
+        self.abstraction.close_edge(((9, 5), (5, 9)))
+        self.assertIsNot(frozen, self.abstraction.frozen_view())
+        self.assertFalse(self.abstraction.frozen_view().is_traversable((9, 5), (5, 9)))
+
+    def test_freeze(self):
+        edges = set(self.abstraction.inter_edges)
+        self.abstraction.freeze()
+        self.assertTrue(self.abstraction.is_frozen)
+        self.assertEqual(edges, set(self.abstraction.inter_edges))
+        self.assertTrue(self.abstraction.is_node((9, 5)))
+        self.assertTrue(self.abstraction.is_traversable((9, 5), (5, 9)))
+        self.abstraction.close_edge(((9, 5), (5, 9)))
+        self.assertFalse(self.abstraction.is_traversable((9, 5), (5, 9)))
+
+
+class TestMultiLevelMap(TestCase):
+    def setUp(self):
+        self.abstraction = MultiLevelMap(LogicalMap("./maps/arena.map"), 0.1, levels=3)
+        self.abstraction.generate_abstract_graph()
+
+    def test_levels(self):
+        self.assertEqual([5, 10, 20], [level.cluster_size for level in self.abstraction.levels])
+        for lower, upper in zip(self.abstraction.levels, self.abstraction.levels[1:]):
+            upper_nodes = set(upper.abstraction_graph.vertices)
+            self.assertTrue(upper_nodes)
+            self.assertLessEqual(upper_nodes, set(lower.abstraction_graph.vertices))
+            for edge in upper.inter_edges:
+                self.assertTrue(lower.is_inter_edge(edge))
+                self.assertNotEqual(upper.get_tile_cluster(edge[0]), upper.get_tile_cluster(edge[1]))
+
+    def test_intra_costs(self):
+        lower, upper = self.abstraction.levels[:2]
+        for edge in upper.abstraction_graph.canonical_edges:
+            if upper.is_edge_type(edge, 'intra'):
+                cluster = upper.get_tile_cluster(edge[0])
+                self.assertEqual(cluster, upper.get_tile_cluster(edge[1]))
+                cost = upper.abstraction_graph.get_edge_label(edge)["cost"]
+                # Never cheaper than the lower level, which may leave the cluster.
+                self.assertGreaterEqual(cost + 1e-9, hpa_high_level(lower, edge[0], edge[1], distance_euclidean)[1])
+
+    def test_stops_without_entrances(self):
+        abstraction = MultiLevelMap(LogicalMap("./maps/arena.map"), 0.2, levels=5)
+        abstraction.generate_abstract_graph()
+        self.assertEqual([10, 20, 40], [level.cluster_size for level in abstraction.levels])
+
 
 # class TestHierarchicalMapPNGWriter(TestCase):
 #
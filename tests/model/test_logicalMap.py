@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 from pbdp.model.map import LogicalMap
 from pbdp.model.vector2d import Vec2d
@@ -9,6 +12,10 @@ class TestLogicalMap(TestCase):
 
     def setUp(self):
         self.testing_map = LogicalMap("./maps/arena.map")
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
 
     def test_cost(self):
         self.assertEqual(self.testing_map.cost(Vec2d(5, 5), Vec2d(6, 5)), 1)
@@ -23,4 +30,44 @@ class TestLogicalMap(TestCase):
 
     def test_is_traversable(self):
         self.assertTrue(self.testing_map.is_traversable((5, 5)))
-        self.assertFalse(self.testing_map.is_traversable((0, 0)))
\ No newline at end of file
+        self.assertFalse(self.testing_map.is_traversable((0, 0)))
+
+    def test_grid(self):
+        self.assertEqual(self.testing_map.grid.shape, (49, 49))
+        self.assertEqual(self.testing_map[0, 0], 'T')
+        self.assertEqual(self.testing_map[5, 5], '.')
+        self.assertEqual(len(self.testing_map.matrix), 49)
+        self.assertEqual(self.testing_map.matrix[5][5], '.')
+
+    def test_binary(self):
+        path = os.path.join(self.directory, "arena.npy")
+        self.testing_map.save_binary(path)
+        loaded = LogicalMap(path)
+        self.assertEqual((loaded.height, loaded.width), (49, 49))
+        self.assertTrue((loaded.grid == self.testing_map.grid).all())
+        self.assertEqual(loaded.cost(Vec2d(5, 5), Vec2d(6, 6)), 2**0.5)
+        self.assertFalse(loaded.is_traversable((0, 0)))
+
+    def test_precompute_moves(self):
+        table_map = LogicalMap("./maps/arena.map", precompute_moves=True)
+        for _, (r, c) in self.testing_map.enumerate():
+            if r in (0, 48) or c in (0, 48):
+                continue
+            tile = Vec2d(r, c)
+            expected = [x for x in self.testing_map.neighbours(tile) if self.testing_map.cost(tile, x) < float('inf')]
+            self.assertEqual(table_map.neighbours(tile), expected)
+            for x in self.testing_map.neighbours(tile):
+                self.assertEqual(table_map.cost(tile, x), self.testing_map.cost(tile, x))
+        self.assertEqual(table_map.cost(Vec2d(2, 2), Vec2d(1, 3)), float('inf'))
+        self.assertEqual(table_map.cost(Vec2d(5, 5), Vec2d(6, 6)), 2**0.5)
+
+    def test_set_tile(self):
+        table_map = LogicalMap("./maps/arena.map", precompute_moves=True)
+        for tile, value in (((5, 5), 'T'), ((1, 1), 'T'), ((0, 3), '.'), ((48, 48), '.')):
+            table_map.set_tile(tile, value)
+            self.assertEqual(value, table_map[tile])
+            self.assertEqual(value == '.', table_map.is_traversable(tile))
+        self.assertEqual(4, table_map.version)
+        masks = table_map.move_masks.copy()
+        table_map.precompute_moves()
+        self.assertTrue((masks == table_map.move_masks).all())
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from pbdp.model.path import Path
+from pbdp.model.policy import Policy
+
+
+class TestPolicy(TestCase):
+
+    def setUp(self):
+        self.policy = Policy()
+        self.policy.add_path(Path(([(0, 0), (0, 3), (4, 3)], 7)))
+        self.policy.add_path(Path(([(0, 0), (0, 3), (4, 3)], 7)))
+        self.policy.add_path(Path(([(0, 0), (0, 3), (0, 4), (4, 4)], 8)))
+        self.policy.add_path(Path(([(0, 0), (3, 0)], 3)))
+
+    def test_is_empty(self):
+        self.assertTrue(Policy().is_empty())
+        self.assertFalse(self.policy.is_empty())
+        empty = Policy()
+        empty.add_path(Path(([], 0)))
+        self.assertTrue(empty.is_empty())
+
+    def test_next_action_score(self):
+        self.assertAlmostEqual((2 * 7 + 8) / 3.0, self.policy.next_action_score((0, 3)))
+        self.assertAlmostEqual(3, self.policy.next_action_score((3, 0)))
+        self.assertEqual(float('inf'), self.policy.next_action_score((5, 5)))
+        self.assertTrue(self.policy.is_valid((0, 0)))
+
+    def test_expand_policy(self):
+        self.policy.next_action_score((0, 3))
+        self.policy.expand_policy((0, 3), 3)
+        self.assertAlmostEqual(7, self.policy.next_action_score((4, 3)))
+        self.assertAlmostEqual(8, self.policy.next_action_score((0, 4)))
+        self.policy.expand_policy((4, 3), 4)
+        self.assertTrue(self.policy.is_empty())
@@ -4,6 +4,7 @@ from pbdp.model.hierarchical_map import HierarchicalMap
 from pbdp.model.map import LogicalMap, distance_euclidean
 from pbdp.model.agents.beliefs import AgentBeliefsModel
 from pbdp.mcts.hindsight_optimization import HindsightOptimization
+from pbdp.mcts.rollouts import ROLLOUTS_PER_TASK, RolloutPool
 
 class TestHindsightOptimization(TestCase):
 
@@ -18,4 +19,56 @@ class TestHindsightOptimization(TestCase):
 
     def test_hindsight_search(self):
         policy = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs, 50)
-        print(policy)
\ No newline at end of file
+        print(policy)
+
+    def test_parallel_search(self):
+        serial, serial_profile = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs, 40, seed=7,
+                                                                   memoize=False)
+        parallel, parallel_profile = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs, 40,
+                                                                       workers=3, seed=7, memoize=False)
+        self.assertEqual(str(serial), str(parallel))
+        self.assertEqual(serial_profile, parallel_profile)
+
+    def test_pool_search(self):
+        with RolloutPool(self.base, 2) as pool:
+            for seed in (7, 8):
+                serial, serial_profile = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs,
+                                                                           40, seed=seed, memoize=False)
+                pooled, pooled_profile = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs,
+                                                                           40, seed=seed, memoize=False, pool=pool)
+                self.assertEqual(str(serial), str(pooled))
+                self.assertEqual(serial_profile, pooled_profile)
+
+    def test_lazy_search(self):
+        serial, _ = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs, 40, seed=7, lazy=True)
+        parallel, _ = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs, 40, workers=2,
+                                                        seed=7, lazy=True)
+        self.assertFalse(serial.is_empty())
+        self.assertEqual(str(serial), str(parallel))
+
+    def test_adaptive_search(self):
+        policy, profile_data = HindsightOptimization.adaptive_search_path((5,5), (40,40), self.base, self.beliefs,
+                                                                         320, seed=3)
+        self.assertLessEqual(profile_data['rollouts'], 320)
+        self.assertFalse(policy.is_empty())
+        certain = AgentBeliefsModel()
+        certain.initialize(self.base, 1.0)
+        policy, profile_data = HindsightOptimization.adaptive_search_path((5,5), (40,40), self.base, certain, 320)
+        self.assertEqual(ROLLOUTS_PER_TASK, profile_data['rollouts'])
+        policy, profile_data = HindsightOptimization.adaptive_search_path((5,5), (40,40), self.base, self.beliefs,
+                                                                         320, z_score=1000, expansion_budget=1)
+        self.assertEqual(ROLLOUTS_PER_TASK, profile_data['rollouts'])
+
+    def test_adaptive_statistics(self):
+        # The rollouts run by the adaptive search are the first ones of the sequential search with the same seed.
+        for lazy in (False, True):
+            for options in ({}, {'z_score': 1e9, 'tolerance': 0.0}):
+                adaptive, adaptive_profile = HindsightOptimization.adaptive_search_path(
+                    (5,5), (40,40), self.base, self.beliefs, 96, seed=3, lazy=lazy, **options)
+                rollouts = adaptive_profile.pop('rollouts')
+                if options:
+                    self.assertEqual(96, rollouts)
+                serial, serial_profile = HindsightOptimization.search_path((5,5), (40,40), self.base, self.beliefs,
+                                                                           rollouts, seed=3, lazy=lazy)
+                self.assertEqual(str(serial), str(adaptive))
+                self.assertEqual(serial_profile, adaptive_profile)
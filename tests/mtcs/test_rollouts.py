@@ -0,0 +1,137 @@
+from unittest import TestCase
+
+import numpy as np
+
+from pbdp.model.hierarchical_map import HierarchicalMap
+from pbdp.model.map import LogicalMap
+from pbdp.model.agents.beliefs import AgentBeliefsModel
+from pbdp.mcts.rollouts import RolloutSampler, RolloutCache, RolloutPool, LazyClosures, run_rollouts
+
+
+class TestRolloutSampler(TestCase):
+
+    def setUp(self):
+        self.base = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        self.base.generate_abstract_graph()
+        self.beliefs = AgentBeliefsModel()
+        self.beliefs.initialize(self.base, 0.7)
+
+    def test_index(self):
+        sampler = RolloutSampler(self.base, self.beliefs)
+        self.assertEqual(len(list(self.base.inter_edges)), sampler.edge_count)
+        self.assertTrue(np.allclose(sampler.open_probabilities, 0.7))
+
+    def test_sample(self):
+        edge = next(iter(self.base.inter_edges))
+        self.beliefs.update(edge, 0.0)
+        sampler = RolloutSampler(self.base, self.beliefs)
+        closed = sampler.sample(20, np.random.default_rng(42))
+        self.assertEqual((20, sampler.edge_count), closed.shape)
+        graph = sampler.map_abstraction.abstraction_graph
+        column = list(sampler.edge_ids).index(graph.edge_id(edge))
+        self.assertTrue(closed[:, column].all())
+        costs = sampler.edge_costs(closed[0])
+        self.assertEqual(float('inf'), costs[graph.edge_id(edge)])
+        self.assertTrue(np.isfinite(graph.costs).all())
+
+    def test_closure_probability(self):
+        # Both orientations of an edge share one belief: the edge closes with probability 1 - 0.7, not 1 - 0.7^2.
+        sampler = RolloutSampler(self.base, self.beliefs)
+        closed = sampler.sample(4000, np.random.default_rng(7))
+        self.assertAlmostEqual(0.3, closed.mean(), delta=0.02)
+
+    def test_certain_beliefs(self):
+        self.beliefs.initialize(self.base, 1.0)
+        sampler = RolloutSampler(self.base, self.beliefs)
+        self.assertFalse(sampler.sample(10).any())
+
+
+class TestRolloutCache(TestCase):
+
+    def setUp(self):
+        self.base = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        self.base.generate_abstract_graph()
+        self.beliefs = AgentBeliefsModel()
+        self.beliefs.initialize(self.base, 0.9)
+
+    def test_lookup(self):
+        cache = RolloutCache()
+        cache.store(np.array([0]), np.array([1, 2]), "Result")
+        self.assertEqual("Result", cache.lookup(np.array([True, False, False, True])))
+        self.assertIsNone(cache.lookup(np.array([False, False, False, True])))
+        self.assertIsNone(cache.lookup(np.array([True, True, False, False])))
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_memoized_costs(self):
+        sampler = RolloutSampler(self.base, self.beliefs)
+        closed = sampler.sample(64, np.random.default_rng(3))
+        plain = run_rollouts(sampler, (5, 5), (40, 40), closed, memoize=False)
+        memoized = run_rollouts(sampler, (5, 5), (40, 40), closed, memoize=True)
+        self.assertTrue(any(x[3] for x in memoized))
+        for expected, result in zip(plain, memoized):
+            self.assertAlmostEqual(expected[1], result[1])
+            self.assertEqual(len(expected[0]) == 0, len(result[0]) == 0)
+
+
+class TestRolloutPool(TestCase):
+
+    def setUp(self):
+        self.base = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        self.base.generate_abstract_graph()
+        self.beliefs = AgentBeliefsModel()
+        self.beliefs.initialize(self.base, 0.8)
+
+    def test_run(self):
+        sampler = RolloutSampler(self.base, self.beliefs)
+        with RolloutPool(self.base, 2) as pool:
+            for seed in (1, 2):
+                closed = sampler.sample(96, np.random.default_rng(seed))
+                serial = run_rollouts(sampler, (5, 5), (40, 40), closed, memoize=False)
+                self.assertEqual(serial, pool.run(sampler, (5, 5), (40, 40), closed, memoize=False))
+                memoized = pool.run(sampler, (5, 5), (40, 40), closed, memoize=True)
+                self.assertTrue(any(x[3] for x in memoized))
+                for expected, result in zip(serial, memoized):
+                    self.assertAlmostEqual(expected[1], result[1])
+            other = RolloutSampler(self.base.cost_view().freeze(), self.beliefs)
+            self.assertRaises(ValueError, pool.run, other, (5, 5), (40, 40), closed)
+
+
+class TestLazyClosures(TestCase):
+
+    def setUp(self):
+        self.base = HierarchicalMap(LogicalMap("./maps/arena.map"), 0.2)
+        self.base.generate_abstract_graph()
+        self.beliefs = AgentBeliefsModel()
+        self.beliefs.initialize(self.base, 0.7)
+
+    def test_draw_on_demand(self):
+        sampler = RolloutSampler(self.base, self.beliefs)
+        closures = sampler.lazy_sample(1, seed=5)[0]
+        self.assertEqual(0, closures.drawn)
+        first = closures[np.array([0, 1, 1])]
+        self.assertEqual(2, closures.drawn)
+        self.assertEqual(first[1], first[2])
+        self.assertTrue(np.array_equal(first, closures[np.array([0, 1, 1])]))
+
+    def test_read_order(self):
+        sampler = RolloutSampler(self.base, self.beliefs)
+        forward, backward = sampler.lazy_sample(1, seed=5)[0], sampler.lazy_sample(1, seed=5)[0]
+        dense = np.arange(sampler.edge_count)
+        forward[dense]
+        backward[dense[::-1]]
+        self.assertTrue(np.array_equal(forward.state, backward.state))
+
+    def test_distribution(self):
+        probabilities = np.array([0.2, 0.9])
+        closures = [LazyClosures(probabilities, np.random.default_rng(x)) for x in range(2000)]
+        frequencies = np.mean([x[np.array([0, 1])] for x in closures], axis=0)
+        self.assertTrue(np.allclose(1 - probabilities, frequencies, atol=0.05))
+
+    def test_lazy_rollouts(self):
+        sampler = RolloutSampler(self.base, self.beliefs)
+        closed = sampler.lazy_sample(40, seed=11)
+        results = run_rollouts(sampler, (5, 5), (40, 40), closed, memoize=False)
+        self.assertEqual(40, len(results))
+        self.assertTrue(any(x.drawn < sampler.edge_count for x in closed))
+        again = run_rollouts(sampler, (5, 5), (40, 40), sampler.lazy_sample(40, seed=11), memoize=False)
+        self.assertEqual(results, again)
@@ -2,7 +2,7 @@ from unittest import TestCase
 
 from pbdp.model.map import LogicalMap, distance_euclidean
 from pbdp.model.vector2d import Vec2d
-from pbdp.search.astar import astar
+from pbdp.search.astar import astar, astar_grid, astar_jps, GridAstar
 
 __author__ = 'davide'
 
@@ -72,3 +72,56 @@ class TestAstar(TestCase):
         path = astar(self.testing_map, Vec2d(5, 5), Vec2d(30, 30), distance_euclidean, config)
         self.assertEqual(31, len(path[0]))
         self.assertTrue('expanded' in path[2])
+
+    def test_astar_grid(self):
+        config = {'profile': True}
+        for start, end in [((5, 5), (5, 5)), ((0, 0), (5, 5)), ((5, 5), (0, 0)), ((5, 5), (30, 30)), ((3, 40), (45, 4))]:
+            path, cost, _ = astar(self.testing_map, Vec2d(start), Vec2d(end), distance_euclidean, config)
+            grid_path, grid_cost, profile_data = astar_grid(self.testing_map, start, end, None, config)
+            self.assertAlmostEqual(cost, grid_cost)
+            self.assertEqual(len(path), len(grid_path))
+            self.assertIn('expanded', profile_data)
+            if grid_path:
+                self.assertEqual([Vec2d(start), Vec2d(end)], [grid_path[0], grid_path[-1]])
+                self.assertAlmostEqual(grid_cost, sum(self.testing_map.cost(x, y) for x, y in zip(grid_path, grid_path[1:])))
+
+    def test_grid_astar_reuse(self):
+        searcher = GridAstar(self.testing_map)
+        first = searcher.search((5, 5), (30, 30), distance_euclidean)
+        searcher.search((40, 3), (3, 40))
+        self.assertEqual(first, searcher.search((5, 5), (30, 30), distance_euclidean))
+        self.assertEqual(3, searcher.current_generation)
+
+    def test_astar_jps(self):
+        config = {'profile': True}
+        for start, end in [((5, 5), (5, 5)), ((0, 0), (5, 5)), ((5, 5), (0, 0)), ((5, 5), (30, 30)), ((3, 40), (45, 4)),
+                           ((40, 3), (4, 44))]:
+            grid_path, grid_cost, _ = astar_grid(self.testing_map, start, end, None, config)
+            path, cost, profile_data = astar_jps(self.testing_map, start, end, None, config)
+            self.assertAlmostEqual(grid_cost, cost)
+            self.assertEqual(len(grid_path), len(path))
+            self.assertIn('expanded', profile_data)
+            self.assertIn('generated', profile_data)
+            if path:
+                self.assertAlmostEqual(cost, sum(self.testing_map.cost(x, y) for x, y in zip(path, path[1:])))
+                self.assertLessEqual(profile_data['expanded'], len(path))
+
+    def test_astar_engine(self):
+        path, cost = astar(self.testing_map, Vec2d(5, 5), Vec2d(30, 30), distance_euclidean)
+        for engine in ('grid', 'jps'):
+            engine_path, engine_cost = astar(self.testing_map, Vec2d(5, 5), Vec2d(30, 30), distance_euclidean,
+                                             {'engine': engine})
+            self.assertAlmostEqual(cost, engine_cost)
+            self.assertEqual(len(path), len(engine_path))
+        self.assertRaises(ValueError, astar, self.testing_map, Vec2d(5, 5), Vec2d(30, 30), distance_euclidean,
+                          {'engine': 'dijkstra'})
+
+    def test_grid_engines_map_change(self):
+        testing_map = LogicalMap("./maps/arena.map")
+        for search in (astar_grid, astar_jps):
+            self.assertIn(Vec2d(5, 6), search(testing_map, (5, 5), (5, 7), None, {'path_only': True}))
+        testing_map.set_tile((5, 6), 'T')
+        for search in (astar_grid, astar_jps):
+            path, cost = search(testing_map, (5, 5), (5, 7))
+            self.assertNotIn(Vec2d(5, 6), path)
+            self.assertAlmostEqual(4, cost)  # Diagonal moves would cut the corners of (5, 6).
@@ -1,10 +1,10 @@
 from unittest import TestCase
 
-from pbdp.model.hierarchical_map import HierarchicalMap
+from pbdp.model.hierarchical_map import HierarchicalMap, MultiLevelMap
 from pbdp.model.map import LogicalMap, distance_euclidean
 from pbdp.model.vector2d import Vec2d
 
-from pbdp.search.hpa import hpa
+from pbdp.search.hpa import RefinementCache, hpa, hpa_high_level, hpa_steps
 
 
 class TestHpa(TestCase):
@@ -18,6 +18,98 @@ class TestHpa(TestCase):
         self._print_path(path)
         self.assertTrue(True)  # TODO: Better test. For now, graphical inspection.
 
+    def test_hpa_engines(self):
+        lengths = set()
+        for engine in ('astar', 'grid', 'jps'):
+            path, profile_data = hpa(self.base, (5, 5), (40, 40), distance_euclidean, engine=engine)
+            self.assertEqual(Vec2d(5, 5), path[0])
+            self.assertEqual(Vec2d(40, 40), path[-1])
+            self.assertIn('generated', profile_data)
+            lengths.add(len(path))
+        self.assertEqual(1, len(lengths))
+
+    def test_hpa_cache(self):
+        cache = RefinementCache()
+        path, _ = hpa(self.base, (5, 5), (40, 40), distance_euclidean)
+        first_path, first_profile = hpa(self.base, (5, 5), (40, 40), distance_euclidean, cache=cache)
+        self.assertEqual(0, first_profile['cache hits'])
+        self.assertGreater(len(cache), 0)
+        cached_path, cached_profile = hpa(self.base, (5, 5), (40, 40), distance_euclidean, cache=cache)
+        self.assertEqual(len(cache), cached_profile['cache hits'])
+        self.assertEqual(first_path, cached_path)
+        self.assertEqual(path, cached_path)
+        back_path, back_profile = hpa(self.base, (40, 40), (5, 5), distance_euclidean, cache=cache)
+        self.assertGreater(back_profile['cache hits'], 0)
+        self.assertEqual(len(path), len(back_path))
+
+        # Edge cost updates and cost views keep the segments, tile changes drop them.
+        size = len(cache)
+        self.base.close_edge(next(x for x in self.base.inter_edges if not set(x) & set(map(tuple, path))))
+        _, closed_profile = hpa(self.base.cost_view(), (5, 5), (40, 40), distance_euclidean, cache=cache)
+        self.assertGreater(closed_profile['cache hits'], 0)
+        self.assertGreaterEqual(len(cache), size)
+        self.base.original_map.set_tile((1, 2), '@')
+        self.base.update_tiles([(1, 2)])
+        self.assertIsNone(cache.get(self.base, *next(iter(self.base.inter_edges))))
+        self.assertEqual(0, len(cache))
+
+    def test_refinement_cache_eviction(self):
+        cache = RefinementCache(max_bytes=2 * RefinementCache.ENTRY_BYTES + 64)
+        cache.put(self.base, (1, 1), (1, 3), [Vec2d(1, 1), Vec2d(1, 2), Vec2d(1, 3)], 2)
+        cache.put(self.base, (2, 1), (2, 3), [Vec2d(2, 1), Vec2d(2, 2), Vec2d(2, 3)], 2)
+        self.assertEqual(([Vec2d(1, 3), Vec2d(1, 2), Vec2d(1, 1)], 2), cache.get(self.base, (1, 3), (1, 1)))
+        cache.put(self.base, (3, 1), (3, 3), [Vec2d(3, 1), Vec2d(3, 2), Vec2d(3, 3)], 2)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(self.base, (2, 1), (2, 3)))
+        self.assertIsNotNone(cache.get(self.base, (1, 1), (1, 3)))
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+
+    def test_hpa_steps(self):
+        path, profile_data = hpa(self.base, (5, 5), (40, 40), distance_euclidean)
+        steps_profile = {}
+        steps = hpa_steps(self.base, (5, 5), (40, 40), distance_euclidean, profile_data=steps_profile)
+        self.assertEqual(Vec2d(5, 5), next(steps))
+        first_expanded = steps_profile['expanded']
+        rest = list(steps)
+        self.assertLess(first_expanded, steps_profile['expanded'])
+        self.assertEqual(profile_data, steps_profile)
+        deduplicated = [x for i, x in enumerate(path) if i == 0 or x != path[i - 1]]
+        self.assertEqual(deduplicated, [Vec2d(5, 5)] + rest)
+
+    def test_hpa_multilevel(self):
+        multilevel = MultiLevelMap(self.base.original_map, 0.1, levels=3)
+        multilevel.generate_abstract_graph()
+        for start, goal in (((5, 5), (40, 40)), ((3, 40), (45, 4)), ((5, 5), (8, 8))):
+            high_level, cost, profile_data = hpa_high_level(multilevel, start, goal, distance_euclidean)
+            self.assertEqual([start, goal], [high_level[0], high_level[-1]])
+            self.assertEqual(3, len(profile_data['level expanded']))
+            for node in high_level[1:-1]:
+                self.assertTrue(multilevel.is_node(node))
+            path, _ = hpa(multilevel, start, goal, distance_euclidean)
+            self.assertEqual([Vec2d(start), Vec2d(goal)], [path[0], path[-1]])
+            for first, second in zip(path, path[1:]):
+                self.assertLess(self.base.original_map.cost(first, second), float('inf'))
+
+    def test_hpa_high_level_clusters(self):
+        frozen = self.base.frozen_view()
+        path, _, _ = hpa_high_level(frozen, (5, 5), (5, 15), distance_euclidean, clusters=[(0, 0), (0, 1)])
+        self.assertEqual((5, 15), path[-1])
+        for node in path:
+            self.assertIn(self.base.get_tile_cluster(node), [(0, 0), (0, 1)])
+        path, _, _ = hpa_high_level(frozen, (5, 5), (5, 15), distance_euclidean, clusters=[(0, 0)])
+        self.assertEqual([], path)
+        self.assertRaises(ValueError, hpa_high_level, self.base, (5, 5), (5, 15), distance_euclidean,
+                          clusters=[(0, 0)])
+
+    def test_hpa_high_level_frozen(self):
+        path, cost, _ = hpa_high_level(self.base, (5, 5), (40, 40), distance_euclidean)
+        self.base.freeze()
+        frozen_path, frozen_cost, profile_data = hpa_high_level(self.base, (5, 5), (40, 40), distance_euclidean)
+        self.assertAlmostEqual(cost, frozen_cost)
+        self.assertEqual((5, 5), frozen_path[0])
+        self.assertEqual((40, 40), frozen_path[-1])
+        self.assertIn('expanded', profile_data)
+
     def _print_path(self, path):
         result = ""
         for r in range(self.base.original_map.height):